@@ -32,6 +32,7 @@ setup(name='dcos-shakedown',
       packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
       include_package_data=True,
       zip_safe=False,
+      python_requires='>=3.5',
       install_requires=[
           'click',
           'dcoscli==0.5.7',
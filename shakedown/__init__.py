@@ -5,13 +5,16 @@ from shakedown.dcos.cluster import *
 from shakedown.dcos.command import *
 from shakedown.dcos.config import *
 from shakedown.dcos.docker import *
+from shakedown.dcos.events import *
 from shakedown.dcos.file import *
+from shakedown.dcos.http_pool import *
 from shakedown.dcos.marathon import *
 from shakedown.dcos.network import *
 from shakedown.dcos.package import *
 from shakedown.dcos.security import *
 from shakedown.dcos.service import *
 from shakedown.dcos.spinner import *
+from shakedown.dcos.state import *
 from shakedown.dcos.task import *
 from shakedown.dcos.zookeeper import *
 from shakedown.dcos.agent import *
@@ -1,3 +1,4 @@
 quiet = False
 ssh_key_file = '~/.ssh/id_rsa'
 ssh_user = 'core'
+dcos_in_process = False
@@ -23,6 +23,10 @@ from shakedown.dcos import dcos_url
 @click.option('-t', '--oauth-token', envvar='SHAKEDOWN_OAUTH_TOKEN', help='OAuth token to use for DC/OS authentication.')
 @click.option('-n', '--username', envvar='SHAKEDOWN_USERNAME', help='Username to use for DC/OS authentication.')
 @click.option('-w', '--password', envvar='SHAKEDOWN_PASSWORD', hide_input=True, help='Password to use for DC/OS authentication.')
+@click.option('--ssh-prewarm', envvar='SHAKEDOWN_SSH_PREWARM', is_flag=True, help='Open SSH connections to all masters and agents before running tests.')
+@click.option('--mesos-events', envvar='SHAKEDOWN_MESOS_EVENTS', is_flag=True, help='Keep Mesos master state current from the operator API event stream instead of polling it.')
+@click.option('--marathon-events', envvar='SHAKEDOWN_MARATHON_EVENTS', is_flag=True, help='Wake Marathon deployment and task waiters as soon as the Marathon event stream reports a change.')
+@click.option('--dcos-in-process', envvar='SHAKEDOWN_DCOS_IN_PROCESS', is_flag=True, help='Run built-in dcos CLI subcommands inside the test process.')
 @click.option('--no-banner', envvar='SHAKEDOWN_NO_BANNER', is_flag=True, help='Suppress the product banner.')
 @click.version_option(version=shakedown.VERSION)
 
@@ -58,6 +62,9 @@ def cli(**args):
     if args['ssh_user']:
         shakedown.cli.ssh_user = args['ssh_user']
 
+    if args['dcos_in_process']:
+        shakedown.cli.dcos_in_process = True
+
     if not args['no_banner']:
         echo(banner(), n=False)
 
@@ -142,6 +149,29 @@ def cli(**args):
                     click.secho("error: no authentication credentials or token found.", fg='red', bold=True)
                     sys.exit(1)
 
+    if args['ssh_prewarm']:
+        echo('Opening SSH connections to cluster nodes...', d='step-min')
+        for host, latency in shakedown.prewarm_connections().items():
+            echo(host, d='item-maj', n=False)
+            if latency is None:
+                echo('unreachable', d='fail')
+            else:
+                echo('{}s'.format(latency), d='pass')
+
+    if args['mesos_events']:
+        echo('Subscribing to Mesos master events...', d='step-min', n=False)
+        if shakedown.start_state_subscriber().wait_connected(10):
+            echo(fchr('PP'), d='pass')
+        else:
+            echo('unavailable, polling instead', d='fail')
+
+    if args['marathon_events']:
+        echo('Subscribing to Marathon events...', d='step-min', n=False)
+        if shakedown.start_marathon_events().wait_connected(10):
+            echo(fchr('PP'), d='pass')
+        else:
+            echo('unavailable, polling instead', d='fail')
+
     class shakedown:
         """ This encapsulates a PyTest wrapper plugin
         """
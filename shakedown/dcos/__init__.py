@@ -4,6 +4,7 @@ import dcos.cluster
 import sys
 
 import shakedown
+from shakedown.dcos.state import get_state_summary, invalidate_state_cache
 
 
 def attach_cluster(url):
@@ -16,6 +17,8 @@ def attach_cluster(url):
         if url == c['url']:
             try:
                 dcos.cluster.set_attached(dcos.cluster.get_cluster(c['name']).get_cluster_path())
+                invalidate_cluster_metadata()
+                invalidate_state_cache()
                 return True
             except:
                 return False
@@ -30,13 +33,67 @@ def dcos_acs_token():
     return dcos.config.get_config().get('core.dcos_acs_token')
 
 
+# (config path, environment, config file stat, url) of the last dcos_url() lookup
+_dcos_url = None
+
+# values which don't change for the life of a cluster, by (name, dcos_url)
+_cluster_metadata = {}
+
+
 def dcos_url():
     """Return the DC/OS URL as configured in the DC/OS library. This is
     equivalent to the value of '--dcos_url' passed into Shakedown on the
-    command line.
+    command line.  The URL is read again only if the config file or the
+    DC/OS environment variables change.
     :return: DC/OS cluster URL as a string
     """
-    return dcos.config.get_config().get('core.dcos_url')
+    global _dcos_url
+
+    env = tuple(os.environ.get(name) for name in ('DCOS_DIR', 'DCOS_CLUSTER', 'DCOS_CONFIG'))
+    if _dcos_url is not None:
+        path, cached_env, stat, url = _dcos_url
+        if env == cached_env and _config_stat(path) == stat:
+            return url
+
+    path = dcos.config.get_config_path()
+    stat = _config_stat(path)
+    url = dcos.config.get_config().get('core.dcos_url')
+    _dcos_url = (path, env, stat, url) if url else None
+    return url
+
+
+def _config_stat(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+def cluster_metadata(name, fetch):
+    """Return a value which doesn't change for the life of the cluster, such
+    as its version, calling fetch() only the first time it is needed for the
+    current DC/OS URL.  None is not remembered, so failed lookups are retried.
+    :param name: the name of the value
+    :param fetch: a function returning the value
+    :return: the value
+    """
+    key = (name, dcos_url())
+    value = _cluster_metadata.get(key)
+    if value is None:
+        value = fetch()
+        if value is not None:
+            _cluster_metadata[key] = value
+    return value
+
+
+def invalidate_cluster_metadata():
+    """Forget the cached DC/OS URL, master IP, versions and other cluster
+    metadata, for example after changing the DC/OS configuration.
+    """
+    global _dcos_url
+    _dcos_url = None
+    _cluster_metadata.clear()
 
 
 def dcos_service_url(service):
@@ -65,8 +122,7 @@ def agents_url():
 
 
 def dcos_state():
-    client = dcos.mesos.DCOSClient()
-    json_data = client.get_state_summary()
+    json_data = get_state_summary()
 
     if json_data:
         return json_data
@@ -95,6 +151,10 @@ def dcos_version():
     """Return the version of the running cluster.
     :return: DC/OS cluster version as a string
     """
+    return cluster_metadata('dcos_version', _fetch_dcos_version)
+
+
+def _fetch_dcos_version():
     url = _gen_url('dcos-metadata/dcos-version.json')
     response = dcos.http.request('get', url)
 
@@ -108,7 +168,7 @@ def master_ip():
     """Returns the public IP address of the DC/OS master.
     return: DC/OS IP address as a string
     """
-    return dcos.mesos.DCOSClient().metadata().get('PUBLIC_IPV4')
+    return cluster_metadata('master_ip', lambda: dcos.mesos.DCOSClient().metadata().get('PUBLIC_IPV4'))
 
 
 def authenticate(username, password):
@@ -3,18 +3,24 @@
 from shakedown import *
 import os
 import pytest
-from dcos import (marathon, mesos)
+from dcos import marathon
 
-from shakedown.dcos import network
+from shakedown.dcos import command, network
+from shakedown.dcos.state import get_state_summary
 
 
 def get_public_agents_public_ip():
     """Provides a list public IPs for public agents in the cluster"""
     public_ip_list = []
     agents = get_public_agents()
+    results = shakedown.run_command_on_hosts(agents, "/opt/mesosphere/bin/detect_ip_public",
+                                             cache_ttl=command.COMMAND_CACHE_TTL)
     for agent in agents:
-        status, public_ip = shakedown.run_command_on_agent(agent, "/opt/mesosphere/bin/detect_ip_public")
-        public_ip_list.append(public_ip)
+        status, public_ip, duration = results[agent]
+        if status:
+            public_ip_list.append(public_ip)
+        else:
+            print("error: unable to detect the public IP of agent {}: {}".format(agent, public_ip.strip()))
 
     return public_ip_list
 
@@ -65,8 +71,7 @@ def get_agents():
 def __get_all_agents():
     """Provides all agent json in the cluster which can be used for filtering"""
 
-    client = mesos.DCOSClient()
-    agents = client.get_state_summary()['slaves']
+    agents = get_state_summary()['slaves']
     return agents
 
 ALLOW_SSH = '-I INPUT -p tcp --dport 22 -j ACCEPT'
@@ -81,13 +86,7 @@ def partition_agent(host):
         :param hostname: host or IP of the machine to partition from the cluster
     """
 
-    network.save_iptables(host)
-    network.flush_all_rules(host)
-    network.allow_all_traffic(host)
-    network.run_iptables(host, ALLOW_SSH)
-    network.run_iptables(host, ALLOW_PING)
-    network.run_iptables(host, DISALLOW_MESOS)
-    network.run_iptables(host, DISALLOW_INPUT)
+    network.partition_host(host, [ALLOW_SSH, ALLOW_PING, DISALLOW_MESOS, DISALLOW_INPUT])
 
 
 def reconnect_agent(host):
@@ -184,6 +183,7 @@ def restart_agent_node(hostname):
     """
 
     run_command_on_agent(hostname, "sudo /sbin/shutdown -r now")
+    invalidate_command_cache(hostname)
 
 
 def delete_agent_log(
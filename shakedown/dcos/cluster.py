@@ -1,9 +1,10 @@
-from dcos.mesos import DCOSClient
 from distutils.version import LooseVersion
 
 import dcos
 import pytest
+
 import shakedown
+from shakedown.dcos.state import get_state_summary
 
 dcos_1_11 = pytest.mark.skipif('dcos_version_less_than("1.11")')
 dcos_1_10 = pytest.mark.skipif('dcos_version_less_than("1.10")')
@@ -93,8 +94,12 @@ def dcos_version_metadata():
 def __metadata_helper(json_path):
     """ Returns json for specific cluster metadata.  Important to realize that
         this was introduced in dcos-1.9.  Clusters prior to 1.9 and missing metadata
-        will return None
+        will return None.  Found metadata is remembered for the life of the process.
     """
+    return shakedown.cluster_metadata(json_path, lambda: __fetch_metadata(json_path))
+
+
+def __fetch_metadata(json_path):
     url = shakedown.dcos_url_path('dcos-metadata/{}'.format(json_path))
     try:
         response = dcos.http.request('get', url)
@@ -177,7 +182,7 @@ def _get_resources(rtype='resources'):
     """
     cpus = 0
     mem = 0
-    summary = DCOSClient().get_state_summary()
+    summary = get_state_summary()
 
     if 'slaves' in summary:
         agents = summary.get('slaves')
@@ -202,7 +207,7 @@ def get_reserved_resources(role=None):
     rtype = 'reserved_resources'
     cpus = 0.0
     mem = 0.0
-    summary = DCOSClient().get_state_summary()
+    summary = get_state_summary()
 
     if 'slaves' in summary:
         agents = summary.get('slaves')
@@ -1,53 +1,194 @@
+import codecs
+import contextlib
+import io
+import re
 import shlex
+import socket
 import subprocess
+import sys
+import threading
 import time
+import uuid
 from _thread import RLock
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
-from select import select
 
 import paramiko
+from dcos import subcommand
 from dcos.errors import DCOSException
 
 import shakedown
-from .helpers import validate_key, try_close, get_transport, start_transport
+from .helpers import get_transport, run_in_ssh_executor, start_transport, try_close, validate_key
 
 
-def connection_cache(func: callable):
+# the largest read taken from a channel at once; paramiko returns whatever is
+# buffered up to this size, so large outputs are consumed in few reads.
+RECV_BUFFER_SIZE = 1024 * 1024
+
+
+class CommandResult(namedtuple('CommandResult', ['command', 'exit_code', 'output'])):
+    """The outcome of a single command run as part of a batch.  `exit_code`
+    is None if the command was never run."""
+
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.exit_code == 0
+
+
+def connection_cache(func: callable = None, max_size=64, idle_ttl=600, keepalive=30):
     """Connection cache for SSH sessions. This is to prevent opening a
-     new, expensive connection on every command run."""
-    cache = dict()
+     new, expensive connection on every command run.
+
+     At most `max_size` connections are kept, evicting the least recently
+     used; connections unused for `idle_ttl` seconds are closed, and SSH
+     keepalives are sent every `keepalive` seconds so that dead peers are
+     noticed before a command is run on them.  Any of these may be None to
+     disable it, and all can be read with `settings` and changed later with
+     `configure`.
+
+     Connections taken with `lease` are never evicted while the lease is
+     held; if every other connection is leased, the cache grows past
+     `max_size` until leases are returned."""
+    if func is None:
+        return lambda f: connection_cache(f, max_size, idle_ttl, keepalive)
+
+    cache = OrderedDict()
+    last_used = dict()
+    # key -> number of leases held on the connection
+    leases = dict()
     lock = RLock()
+    # one lock per host/user, so that concurrent callers share a single new
+    # connection without serializing connections to different hosts.
+    key_locks = dict()
+    settings = {'max_size': max_size, 'idle_ttl': idle_ttl, 'keepalive': keepalive}
+    counters = {'hits': 0, 'misses': 0, 'reconnects': 0, 'evictions': 0}
+
+    def is_valid(conn):
+        return conn and conn.is_active() and conn.is_authenticated()
+
+    def in_use(key):
+        """Whether a lease is held on a connection which is still up."""
+        return leases.get(key, 0) > 0 and cache[key].is_active()
+
+    def remove(key):
+        last_used.pop(key, None)
+        return cache.pop(key)
+
+    def expired(now, keep):
+        """Remove and return connections that have been idle too long, or
+        that exceed the size bound, other than `keep`, the one being
+        handed out.  Must be called holding `lock`."""
+        evicted = []
+        if settings['idle_ttl'] is not None:
+            for k in [k for k, t in last_used.items() if now - t > settings['idle_ttl']]:
+                if k != keep and not in_use(k):
+                    evicted.append(remove(k))
+        if settings['max_size'] is not None:
+            for k in list(cache):
+                if len(cache) <= settings['max_size']:
+                    break
+                if k != keep and not in_use(k):
+                    evicted.append(remove(k))
+        counters['evictions'] += len(evicted)
+        return evicted
 
     @wraps(func)
     def func_wrapper(host: str, username: str, *args, **kwargs):
         key = "{h}-{u}".format(h=host, u=username)
-        if key in cache:
-            # connection exists, check if it is still valid before
-            # returning it.
-            conn = cache[key]
-            if conn and conn.is_active() and conn.is_authenticated():
-                return conn
+        with lock:
+            key_lock = key_locks.setdefault(key, RLock())
+        with key_lock:
+            return _get_or_create(key, False, host, username, *args, **kwargs)
+
+    @contextlib.contextmanager
+    def lease(host: str, username: str, *args, **kwargs):
+        """The connection, as calling the function returns it, which isn't
+        evicted until the block ends."""
+        key = "{h}-{u}".format(h=host, u=username)
+        with lock:
+            key_lock = key_locks.setdefault(key, RLock())
+        with key_lock:
+            conn = _get_or_create(key, True, host, username, *args, **kwargs)
+        try:
+            yield conn
+        finally:
+            if conn is not None:
+                with lock:
+                    leases[key] -= 1
+                    if not leases[key]:
+                        del leases[key]
+
+    def _get_or_create(key, leased, host, username, *args, **kwargs):
+        stale = None
+        with lock:
+            now = time.time()
+            evicted = expired(now, key)
+            if key in cache:
+                # connection exists, check if it is still valid before
+                # returning it.
+                conn = cache[key]
+                if is_valid(conn):
+                    counters['hits'] += 1
+                    cache.move_to_end(key)
+                    last_used[key] = now
+                    if leased:
+                        leases[key] = leases.get(key, 0) + 1
+                else:
+                    # remove a bad connection from the cache; it is closed
+                    # below, outside of the lock.
+                    counters['reconnects'] += 1
+                    stale = remove(key)
+                    conn = None
             else:
-                # try to close a bad connection and remove it from
-                # the cache.
-                if conn:
-                    try_close(conn)
-                del cache[key]
+                counters['misses'] += 1
+                conn = None
+
+        for c in evicted + [stale]:
+            if c:
+                try_close(c)
+
+        if conn is not None:
+            return conn
 
         # key is not in the cache, so try to recreate it
         # it may have been removed just above.
-        if key not in cache:
-            conn = func(host, username, *args, **kwargs)
-            if conn is not None:
+        conn = func(host, username, *args, **kwargs)
+        if conn is not None:
+            if settings['keepalive'] and hasattr(conn, 'set_keepalive'):
+                conn.set_keepalive(settings['keepalive'])
+            with lock:
                 cache[key] = conn
-            return conn
-
-        # not sure how to reach this point, but just in case.
-        return None
+                last_used[key] = time.time()
+                if leased:
+                    leases[key] = leases.get(key, 0) + 1
+                evicted = expired(last_used[key], key)
+            for c in evicted:
+                try_close(c)
+        return conn
 
     def get_cache() -> dict:
         return cache
 
+    def stats() -> dict:
+        with lock:
+            result = dict(counters)
+            result['size'] = len(cache)
+            return result
+
+    def get_settings() -> dict:
+        with lock:
+            return dict(settings)
+
+    def configure(**kwargs):
+        with lock:
+            for k, v in kwargs.items():
+                if k not in settings:
+                    raise ValueError('unknown connection cache setting: {}'.format(k))
+                settings[k] = v
+
     def purge(key: str=None):
         with lock:
             if key is None:
@@ -59,9 +200,13 @@ def connection_cache(func: callable):
 
             for k, v in conns:
                 try_close(v)
-                del cache[k]
+                remove(k)
 
     func_wrapper.get_cache = get_cache
+    func_wrapper.lease = lease
+    func_wrapper.stats = stats
+    func_wrapper.configure = configure
+    func_wrapper.settings = get_settings
     func_wrapper.purge = purge
     return func_wrapper
 
@@ -88,7 +233,7 @@ def _get_connection(host, username: str, key_path: str) \
     transport = get_transport(host, username, key)
 
     if transport:
-        transport = start_transport(transport, username, key)
+        transport = start_transport(transport, username, key, host)
         if transport.is_authenticated():
             return transport
         else:
@@ -99,12 +244,68 @@ def _get_connection(host, username: str, key_path: str) \
     return None
 
 
+def prewarm_connections(
+        hosts=None,
+        username=None,
+        key_path=None,
+        max_workers=32
+):
+    """ Open and authenticate SSH connections to many hosts concurrently, so
+        that the first command run on each doesn't pay for the handshake.
+
+        :param hosts: hosts or IPs to connect to; all masters and agents by default
+        :type hosts: [str]
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+        :param max_workers: maximum number of connections to open at once
+        :type max_workers: int
+
+        :return: a mapping of host to connection time in seconds, or None if unreachable
+        :rtype: OrderedDict
+    """
+
+    if hosts is None:
+        hosts = [shakedown.master_ip()] + shakedown.get_all_master_ips() + shakedown.get_agents()
+
+    hosts = list(OrderedDict.fromkeys(hosts))
+    results = OrderedDict()
+
+    if not hosts:
+        return results
+
+    # the cache would otherwise evict, and close, connections opened here
+    max_size = _get_connection.settings()['max_size']
+    if max_size is not None and max_size < len(hosts):
+        print("warning: raising the SSH connection cache size from {} to {} to hold a connection to every host".format(
+            max_size, len(hosts)))
+        _get_connection.configure(max_size=len(hosts))
+
+    def connect(host):
+        start = time.time()
+        try:
+            conn = _get_connection(host, username, key_path)
+        except Exception as e:
+            print("error: unable to connect to {}: {}".format(host, e))
+            conn = None
+        return round(time.time() - start, 3) if conn else None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(hosts))) as executor:
+        futures = [(host, executor.submit(connect, host)) for host in hosts]
+        for host, future in futures:
+            results[host] = future.result()
+
+    return results
+
+
 def run_command(
         host,
         command,
         username=None,
         key_path=None,
-        noisy=True
+        noisy=True,
+        timeout=None
 ):
     """ Run a command via SSH, proxied through the mesos master
 
@@ -116,13 +317,17 @@ def run_command(
         :type username: str
         :param key_path: path to the SSH private key to use for SSH authentication
         :type key_path: str
+        :param timeout: seconds to wait for the command to complete, or None to wait forever
+        :type timeout: float
         :return: True if successful, False otherwise
         :rtype: bool
-        :return: Output of command
+        :return: Output of command, or why the host couldn't be reached
         :rtype: string
     """
     
-    with HostSession(host, username, key_path, noisy) as s:
+    with HostSession(host, username, key_path, noisy, timeout) as s:
+        if s.session is None:
+            return False, 'unable to connect to {}'.format(host)
         if noisy:
             print("\n{}{} $ {}\n".format(shakedown.fchr('>>'), host, command))
         s.run(command)
@@ -131,6 +336,100 @@ def run_command(
     return ec == 0, output
 
 
+async def run_command_async(
+        host,
+        command,
+        username=None,
+        key_path=None,
+        noisy=True,
+        timeout=None
+):
+    """ Run a command via SSH, proxied through the mesos master, without
+        blocking the event loop.  Takes the same parameters as `run_command`.
+
+        :return: True if successful, False otherwise
+        :rtype: bool
+        :return: Output of command
+        :rtype: string
+    """
+
+    return await run_in_ssh_executor(run_command, host, command, username, key_path, noisy, timeout)
+
+
+# how long run_command_cached reuses a result, in seconds
+COMMAND_CACHE_TTL = 300
+
+# (host, username, command) -> (time of the run, output)
+_command_cache = {}
+_command_cache_lock = RLock()
+
+
+def run_command_cached(
+        host,
+        command,
+        username=None,
+        key_path=None,
+        noisy=True,
+        ttl=None,
+        timeout=None
+):
+    """ Run a read-only command via SSH, reusing the output of an earlier
+        successful run of the same command on the same host, as the same
+        user, for up to `ttl` seconds.  Only use this for commands whose
+        output doesn't change while the host is up, such as `uname -r`;
+        failures are never cached.  Call `invalidate_command_cache` when
+        the host changes.
+
+        :param host: host or IP of the machine to execute the command on
+        :type host: str
+        :param command: the command to execute
+        :type command: str
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+        :param ttl: seconds for which a result is reused, or None for `COMMAND_CACHE_TTL`
+        :type ttl: float
+        :param timeout: seconds to wait for the command to complete, or None to wait forever
+        :type timeout: float
+        :return: True if successful, False otherwise
+        :rtype: bool
+        :return: Output of command
+        :rtype: string
+    """
+
+    if ttl is None:
+        ttl = COMMAND_CACHE_TTL
+    key = (host, username or shakedown.cli.ssh_user, command)
+    with _command_cache_lock:
+        entry = _command_cache.get(key)
+    if entry is not None and time.time() - entry[0] < ttl:
+        if noisy:
+            print("\n{}{} $ {} (cached)\n".format(shakedown.fchr('>>'), host, command))
+        return True, entry[1]
+
+    success, output = run_command(host, command, username, key_path, noisy, timeout)
+    if success:
+        with _command_cache_lock:
+            _command_cache[key] = (time.time(), output)
+    return success, output
+
+
+def invalidate_command_cache(host=None):
+    """ Forget the results cached by `run_command_cached`
+
+        :param host: host or IP of the machine whose results to forget, or None for all hosts
+        :type host: str
+    """
+
+    with _command_cache_lock:
+        if host is None:
+            _command_cache.clear()
+        else:
+            for key in [k for k in _command_cache if k[0] == host]:
+                del _command_cache[key]
+
+
 def run_command_on_master(
         command,
         username=None,
@@ -180,7 +479,175 @@ def run_command_on_agent(
     return run_command(host, command, username, key_path, noisy)
 
 
-def run_dcos_command(command, raise_on_error=False, print_output=True):
+def run_commands(
+        host,
+        commands,
+        username=None,
+        key_path=None,
+        noisy=True,
+        stop_on_error=False,
+        timeout=None
+):
+    """ Run an ordered list of commands via SSH, proxied through the mesos
+        master, in a single session.  The output and exit status of each
+        command are framed so they can be reported separately, at the cost
+        of one round trip for the whole batch.
+
+        :param host: host or IP of the machine to execute the commands on
+        :type host: str
+        :param commands: the commands to execute, in order
+        :type commands: [str]
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+        :param noisy: print the commands and their output
+        :type noisy: bool
+        :param stop_on_error: skip the remaining commands once one fails
+        :type stop_on_error: bool
+        :param timeout: seconds to wait for the batch to complete, or None to wait forever
+        :type timeout: float
+
+        :return: a result for each command, in order
+        :rtype: [CommandResult]
+    """
+
+    marker = 'shakedown-{}'.format(uuid.uuid4().hex)
+    script = []
+    for i, command in enumerate(commands):
+        script.append('echo "{} begin {}"'.format(marker, i))
+        script.append(command)
+        script.append('rc=$?; printf "\\n{} end {} %d\\n" "$rc"'.format(marker, i))
+        if stop_on_error:
+            script.append('[ "$rc" -eq 0 ] || exit "$rc"')
+
+    if noisy:
+        for command in commands:
+            print("\n{}{} $ {}".format(shakedown.fchr('>>'), host, command))
+
+    success, output = run_command(host, '\n'.join(script), username, key_path, False, timeout)
+
+    framed = re.compile(r'{m} begin (\d+)\n(.*?)\n{m} end \1 (\d+)\n'.format(m=re.escape(marker)), re.S)
+    completed = {int(i): (int(rc), out) for i, out, rc in framed.findall(output)}
+
+    results = []
+    for i, command in enumerate(commands):
+        exit_code, out = completed.get(i, (None, ''))
+        if noisy:
+            print("\n{}{} $ {} ({})\n{}".format(shakedown.fchr('>>'), host, command, exit_code, out))
+        results.append(CommandResult(command, exit_code, out))
+
+    return results
+
+
+def run_commands_on_agent(
+        host,
+        commands,
+        username=None,
+        key_path=None,
+        noisy=True,
+        stop_on_error=False
+):
+    """ Run an ordered list of commands on a Mesos agent in a single session,
+        proxied through the master
+    """
+
+    return run_commands(host, commands, username, key_path, noisy, stop_on_error)
+
+
+def stream_command(
+        host,
+        command,
+        username=None,
+        key_path=None,
+        noisy=True,
+        timeout=None
+):
+    """ Run a command via SSH, proxied through the mesos master, and iterate
+        over its output lines as they arrive.  stdout and stderr are merged.
+        Iterating raises a ConnectionError if the host can't be reached.
+
+        :param host: host or IP of the machine to execute the command on
+        :type host: str
+        :param command: the command to execute
+        :type command: str
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+        :param noisy: print the command and its output
+        :type noisy: bool
+        :param timeout: seconds to wait for the command to complete, or None to wait forever
+        :type timeout: float
+
+        :return: an iterable of output lines; `exit_code` is set once it is exhausted
+        :rtype: CommandStream
+    """
+
+    return CommandStream(host, command, username, key_path, noisy, timeout)
+
+
+def run_command_on_hosts(
+        hosts,
+        command,
+        username=None,
+        key_path=None,
+        noisy=False,
+        max_workers=16,
+        timeout=None,
+        cache_ttl=None
+):
+    """ Run the same command on many hosts concurrently, reusing cached
+        connections.  The sweep takes about as long as the slowest host.
+
+        :param hosts: hosts or IPs of the machines to execute the command on
+        :type hosts: [str]
+        :param command: the command to execute
+        :type command: str
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+        :param noisy: print the command and its output for each host
+        :type noisy: bool
+        :param max_workers: maximum number of hosts to run the command on at once
+        :type max_workers: int
+        :param timeout: seconds to wait for the command on each host, or None to wait forever
+        :type timeout: float
+        :param cache_ttl: reuse results of this read-only command for this many seconds,
+            as `run_command_cached` does, or None to always run it
+        :type cache_ttl: float
+
+        :return: a mapping of host to (success, output, duration in seconds)
+        :rtype: OrderedDict
+    """
+
+    hosts = list(OrderedDict.fromkeys(hosts))
+    results = OrderedDict()
+
+    if not hosts:
+        return results
+
+    def run_on_host(host):
+        start = time.time()
+        try:
+            if cache_ttl is None:
+                success, output = run_command(host, command, username, key_path, noisy, timeout)
+            else:
+                success, output = run_command_cached(host, command, username, key_path, noisy, cache_ttl, timeout)
+        except Exception as e:
+            success, output = False, str(e)
+        return success, output, round(time.time() - start, 3)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(hosts))) as executor:
+        futures = [(host, executor.submit(run_on_host, host)) for host in hosts]
+        for host, future in futures:
+            results[host] = future.result()
+
+    return results
+
+
+def run_dcos_command(command, raise_on_error=False, print_output=True, in_process=None):
     """ Run `dcos {command}` via DC/OS CLI
 
         :param command: the command to execute
@@ -189,6 +656,9 @@ def run_dcos_command(command, raise_on_error=False, print_output=True):
         :type raise_on_error: bool
         :param print_output: whether to print the resulting stdout/stderr from running the command
         :type print_output: bool
+        :param in_process: whether to run built-in subcommands inside this process rather than
+            forking `dcos`; defaults to `shakedown.cli.dcos_in_process`
+        :type in_process: bool
 
         :return: (stdout, stderr, return_code)
         :rtype: tuple
@@ -199,82 +669,289 @@ def run_dcos_command(command, raise_on_error=False, print_output=True):
 
     print("\n{}{}\n".format(shakedown.fchr('>>'), ' '.join(call)))
 
-    proc = subprocess.Popen(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    output, error = proc.communicate()
-    return_code = proc.wait()
-    stdout = output.decode('utf-8')
-    stderr = error.decode('utf-8')
+    stdout, stderr, return_code = _execute_dcos_command(call, in_process)
 
     if print_output:
         print(stdout, stderr, return_code)
 
     if return_code != 0 and raise_on_error:
-        raise DCOSException(
-            'Got error code {} when running command "dcos {}":\nstdout: "{}"\nstderr: "{}"'.format(
-            return_code, command, stdout, stderr))
+        raise DCOSException(_dcos_error_message(command, stdout, stderr, return_code))
 
     return stdout, stderr, return_code
 
 
+class DCOSCommandResult(namedtuple('DCOSCommandResult', ['command', 'stdout', 'stderr', 'return_code', 'duration'])):
+    """The outcome of a `dcos` command run by `run_dcos_commands`, with how
+    long it took in seconds."""
+
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.return_code == 0
+
+
+def run_dcos_commands(commands, max_workers=8, raise_on_error=False, print_output=True, in_process=None):
+    """ Run several independent `dcos {command}` calls concurrently
+
+        :param commands: the commands to execute
+        :type commands: list
+        :param max_workers: the maximum number of commands to run at once
+        :type max_workers: int
+        :param raise_on_error: whether to raise a DCOSException if any return code is nonzero
+        :type raise_on_error: bool
+        :param print_output: whether to print each command with its stdout/stderr, in order
+        :type print_output: bool
+        :param in_process: whether to run built-in subcommands inside this process
+        :type in_process: bool
+
+        :return: the result of each command, in the order given
+        :rtype: [DCOSCommandResult]
+    """
+
+    def run(command):
+        start = time.time()
+        stdout, stderr, return_code = _execute_dcos_command(['dcos'] + shlex.split(command), in_process)
+        return DCOSCommandResult(command, stdout, stderr, return_code, time.time() - start)
+
+    commands = list(commands)
+    if not commands:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(commands))) as executor:
+        results = list(executor.map(run, commands))
+
+    if print_output:
+        for result in results:
+            print("\n{}dcos {} ({:.2f}s)\n".format(shakedown.fchr('>>'), result.command, result.duration))
+            print(result.stdout, result.stderr, result.return_code)
+
+    failures = [r for r in results if not r.success]
+    if failures and raise_on_error:
+        raise DCOSException('{} of {} commands failed:\n{}'.format(
+            len(failures), len(results),
+            '\n'.join(_dcos_error_message(r.command, r.stdout, r.stderr, r.return_code) for r in failures)))
+
+    return results
+
+
+def _dcos_error_message(command, stdout, stderr, return_code):
+    return 'Got error code {} when running command "dcos {}":\nstdout: "{}"\nstderr: "{}"'.format(
+        return_code, command, stdout, stderr)
+
+
+def _execute_dcos_command(call, in_process=None):
+    if in_process is None:
+        in_process = shakedown.cli.dcos_in_process
+
+    if in_process and _is_default_subcommand(call[1:]):
+        return _run_dcos_in_process(call[1:])
+    return _run_dcos_subprocess(call)
+
+
+def _run_dcos_subprocess(call):
+    proc = subprocess.Popen(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, error = proc.communicate()
+    return_code = proc.wait()
+    return output.decode('utf-8'), error.decode('utf-8'), return_code
+
+
+def _is_default_subcommand(args):
+    """ Whether `dcos {args}` is served by a subcommand built into the CLI.
+        Global options and installed package subcommands still need `dcos`.
+    """
+    return len(args) > 0 and args[0] in subcommand.default_subcommands()
+
+
+# sys.stdout and sys.stderr are process wide, so in-process commands run one at a time
+_dcos_cli_lock = RLock()
+
+
+class _ThreadOutput(io.TextIOBase):
+    """Stands in for sys.stdout or sys.stderr while a command runs in
+    process, capturing what the running thread writes and passing what any
+    other thread writes, such as spinners or SSH output, to the real stream."""
+
+    def __init__(self, stream, capture):
+        self.stream = stream
+        self.capture = capture
+        self.thread = threading.get_ident()
+
+    def _target(self):
+        return self.capture if threading.get_ident() == self.thread else self.stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def writable(self):
+        return True
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def _run_dcos_in_process(args):
+    """ Run a built-in `dcos` subcommand in this process, capturing what it
+        writes to stdout and stderr.  This saves starting the CLI, reading its
+        configuration and setting up TLS on every call.  Output from other
+        threads while the command runs is not captured, so neither is output
+        from any threads the subcommand itself starts.
+
+        :param args: the subcommand and its arguments
+        :type args: list
+
+        :return: (stdout, stderr, return_code)
+        :rtype: tuple
+    """
+    from dcoscli.subcommand import SubcommandMain
+
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    with _dcos_cli_lock, \
+            contextlib.redirect_stdout(_ThreadOutput(sys.stdout, stdout)), \
+            contextlib.redirect_stderr(_ThreadOutput(sys.stderr, stderr)):
+        try:
+            return_code, error = SubcommandMain(args[0], args[1:]).run_and_capture()
+        except SystemExit as e:
+            # docopt exits with the usage message on invalid arguments
+            error = None
+            if e.code is None or isinstance(e.code, int):
+                return_code = e.code or 0
+            else:
+                print(e.code, file=sys.stderr)
+                return_code = 1
+
+    captured = stderr.getvalue()
+    # the traceback of an unexpected exception, if it wasn't printed already
+    if error and error not in captured:
+        captured += error
+    return stdout.getvalue(), captured, return_code or 0
+
+
 class HostSession:
     """Context manager that returns an SSH session, reusing authenticated connections.
     
     """
-    def __init__(self, host, username, key_path, verbose):
+    def __init__(self, host, username, key_path, verbose, timeout=None):
         self.host = host
         self.username = username
         self.key_path = key_path
         self.verbose = verbose
+        self.timeout = timeout
         self.exit_code = -1
         self.output = ''
         self.session = None
+        self.started = time.time()
     
     def __enter__(self):
         """
         :return: this session manager
         :rtype: HostSession
         """
-        c = _get_connection(self.host, self.username, self.key_path)
+        # the connection is leased, so the cache can't evict it while the session is open
+        self._lease = contextlib.ExitStack()
+        c = self._lease.enter_context(_get_connection.lease(self.host, self.username, self.key_path))
         if c:
             self.session = c.open_session()
         
         return self
     
-    def __exit__(self, *args):
+    def __exit__(self, exc_type, *args):
         """Executed when the context manager is complete.
 
+        Output is read as it arrives, blocking on the channel rather than
+        polling it, so a trivial command costs about one round trip.
+
         :return: None
         """
-        self.exit_code = self.session.recv_exit_status()
-        self._wait_for_recv()
-        # read data that is ready
-        while self.session.recv_ready():
-            # lists of file descriptors that are ready for IO
-            # read, write, "exceptional condition" (?)
-            rl, wl, xl = select([self.session], [], [], 0.0)
-            if len(rl) > 0:
-                recv = str(self.session.recv(1024), "utf-8")
+        try:
+            return self._finish(exc_type)
+        finally:
+            self._lease.close()
+
+    def _finish(self, exc_type):
+        if self.session is None:
+            return False
+
+        if exc_type is not None:
+            # the block was abandoned; don't wait on the remote command.
+            try_close(self.session)
+            return False
+
+        chunks = []
+        try:
+            for chunk in self._recv_output():
                 if self.verbose:
-                    print(recv, end='', flush=True)
-                self.output += recv
-        try_close(self.session)
+                    print(chunk, end='', flush=True)
+                chunks.append(chunk)
+            if self.session.status_event.wait(self._remaining()):
+                self.exit_code = self.session.recv_exit_status()
+            else:
+                chunks.append(self._timeout_message())
+        except socket.timeout:
+            # the command did not complete in time; closing the session
+            # leaves the exit code at -1.
+            chunks.append(self._timeout_message())
+        finally:
+            self.output = ''.join(chunks)
+            try_close(self.session)
         # no Exceptions were handled; return False
         return False
-    
-    def _wait_for_recv(self):
-        """After executing a command, wait for results.
-        
-        Because `recv_ready()` can return False, but still have a
-        valid, open connection, it is not enough to ensure output
-        from a command execution is properly captured.
 
-        :return: None
+    def iter_lines(self):
+        """Yield lines of output as they arrive, without their line endings.
+        The exit code is available from `get_result` once the output is
+        exhausted.  A `socket.timeout` is raised if the command outlives
+        this session's timeout.
+
+        :return: generator of output lines
         """
+        pending = ''
+        for chunk in self._recv_output():
+            if self.verbose:
+                print(chunk, end='', flush=True)
+            lines = (pending + chunk).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if pending:
+            yield pending
+        if self.session.status_event.wait(self._remaining()):
+            self.exit_code = self.session.recv_exit_status()
+
+    def _recv_output(self):
+        """Yield decoded output as it arrives, until the remote end closes
+        the stream.  Multi-byte characters split across reads are decoded
+        once complete.
+
+        :return: generator of output strings
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
         while True:
-            time.sleep(0.2)
-            if self.session.recv_ready() or self.session.closed:
-                return
-    
+            self.session.settimeout(self._remaining())
+            data = self.session.recv(RECV_BUFFER_SIZE)
+            if not data:
+                break
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode(b'', final=True)
+        if text:
+            yield text
+
+    def _remaining(self):
+        """Seconds left before the command times out, or None for no timeout.
+        """
+        if self.timeout is None:
+            return None
+        return max(0.0, self.started + self.timeout - time.time())
+
+    def _timeout_message(self):
+        return '\ntimed out after {} seconds'.format(self.timeout)
+
     def run(self, command):
         """Run `command` on this SSH session. This does not return the
         result, use `get_result` to retrieve command's results.
@@ -283,8 +960,42 @@ class HostSession:
         :type command: str
         
         :return: None
+        :raises ConnectionError: if the host couldn't be reached
         """
+        if self.session is None:
+            raise ConnectionError('unable to open an SSH session to {}'.format(self.host))
+        self.started = time.time()
         self.session.exec_command(command)
     
     def get_result(self):
         return self.exit_code, self.output
+
+
+class CommandStream:
+    """Iterable over the output lines of a remote command.  Leaving the loop
+    early closes the session without waiting for the command to finish.
+
+    """
+    def __init__(self, host, command, username, key_path, noisy, timeout):
+        self.host = host
+        self.command = command
+        self.username = username
+        self.key_path = key_path
+        self.noisy = noisy
+        self.timeout = timeout
+        self.exit_code = None
+
+    def __iter__(self):
+        with HostSession(self.host, self.username, self.key_path, False, self.timeout) as s:
+            if s.session is None:
+                raise ConnectionError('unable to open an SSH session to {}'.format(self.host))
+            if self.noisy:
+                print("\n{}{} $ {}\n".format(shakedown.fchr('>>'), self.host, self.command))
+            s.session.set_combine_stderr(True)
+            s.run(self.command)
+            for line in s.iter_lines():
+                if self.noisy:
+                    print(line)
+                yield line
+
+        self.exit_code = s.exit_code
@@ -7,6 +7,7 @@ from datetime import timedelta
 import shakedown
 
 from dcos import marathon
+from dcos.errors import DCOSException
 
 
 def docker_version(host=None, component='server'):
@@ -29,9 +30,9 @@ def docker_version(host=None, component='server'):
     command = 'sudo docker version -f {{.{}.Version}}'.format(component)
 
     if host is None:
-        success, output = shakedown.run_command_on_master(command, None, None, False)
-    else:
-        success, output = shakedown.run_command_on_host(host, command, None, None, False)
+        host = shakedown.master_ip()
+
+    success, output = shakedown.run_command_cached(host, command, None, None, False)
 
     if success:
         return output
@@ -110,8 +111,10 @@ def __distribute_docker_credentials_file(file_name='docker.tar.gz'):
         Used to access private docker repositories in tests.
     """
     # Upload docker.tar.gz to all private agents
-    for host in shakedown.get_private_agents():
-        shakedown.copy_file(host, file_name)
+    results = shakedown.broadcast_file(file_name, shakedown.get_private_agents())
+    failed = sorted(host for host, success in results.items() if not success)
+    if failed:
+        raise DCOSException('failed to distribute {} to: {}'.format(file_name, ', '.join(failed)))
 
 
 def distribute_docker_credentials_to_private_agents(
@@ -0,0 +1,576 @@
+""" Cluster state kept current from event streams rather than polling.
+
+    A `MasterStateSubscriber` follows the Mesos v1 operator API `SUBSCRIBE`
+    stream and keeps a model of the frameworks, agents and tasks, which
+    `get_master_state()` (and so the service and task helpers) read instead
+    of downloading `/state` while the stream is up.
+
+    A `MarathonEventStream` follows Marathon's `/v2/events` server-sent
+    events, and wakes the waiters sleeping on an `EventWakeup` between ticks
+    as soon as an event they care about arrives.
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urljoin
+
+from dcos import http
+
+from shakedown.dcos import dcos_service_url, master_url
+from shakedown.dcos.state import COMPLETED_TASK_STATES, invalidate_state_cache, set_live_state
+
+
+# seconds to wait before reconnecting a dropped stream, doubling up to the maximum
+SUBSCRIBE_RETRY_SECONDS = 1
+SUBSCRIBE_RETRY_MAX_SECONDS = 30
+
+
+def subscribe_request(url, timeout):
+    """ Send the operator API `SUBSCRIBE` call
+
+        :param url: the master's operator API endpoint
+        :type url: str
+        :param timeout: (connect, read) timeouts in seconds
+        :type timeout: tuple
+
+        :return: the streaming response
+        :rtype: requests.Response
+    """
+    return http.post(url,
+                     json={'type': 'SUBSCRIBE'},
+                     headers={'Content-Type': 'application/json', 'Accept': 'application/json'},
+                     stream=True,
+                     timeout=timeout)
+
+
+def recordio_records(chunks):
+    """ Decode RecordIO, where each record is its length in bytes, a newline
+        and the JSON record, from chunks of bytes as they arrive.
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        while True:
+            newline = buffer.find(b'\n')
+            if newline < 0:
+                break
+            end = newline + 1 + int(buffer[:newline])
+            if len(buffer) < end:
+                break
+            record = json.loads(buffer[newline + 1:end].decode('utf-8'))
+            del buffer[:end]
+            yield record
+
+
+class MasterStateSubscriber:
+    """ Keeps a model of the master state current from the operator API event
+        stream, in the form of the master's `/state`, reconnecting whenever
+        the stream drops.
+
+        :param url: the operator API endpoint; defaults to the master's `api/v1`
+        :type url: str
+        :param request: sends the `SUBSCRIBE` call, as `subscribe_request` does
+        :type request: function
+    """
+
+    def __init__(self, url=None, request=subscribe_request):
+        self.url = url or urljoin(master_url(), 'api/v1')
+        self.request = request
+        self.events = 0
+        self.reconnects = 0
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._subscribed = threading.Event()
+        self._response = None
+        self._thread = None
+        self._heartbeat = 15
+        self._last_event = 0
+        self._reset()
+
+    @property
+    def connected(self):
+        """ Whether the model is current: subscribed, and heard from recently """
+        return self._subscribed.is_set() and time.time() - self._last_event < 3 * self._heartbeat
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='mesos-subscriber', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._disconnect()
+
+    def wait_connected(self, timeout=None):
+        """ Block until the first snapshot has arrived
+
+            :return: True if connected, False on timeout
+            :rtype: bool
+        """
+        return self._subscribed.wait(timeout)
+
+    def state(self):
+        """ The model as the master's `/state` would show it.  A new dict is
+            built only when an event has changed the model.
+        """
+        with self._lock:
+            if self._state is None:
+                self._state = self._build_state()
+            return self._state
+
+    def _run(self):
+        delay = SUBSCRIBE_RETRY_SECONDS
+        while not self._stopped.is_set():
+            try:
+                self._response = self.request(self.url, (5, 3 * self._heartbeat))
+                for event in recordio_records(self._response.iter_content(chunk_size=None)):
+                    self._handle(event)
+                    delay = SUBSCRIBE_RETRY_SECONDS
+                    if self._stopped.is_set():
+                        break
+            except Exception:
+                pass
+            self._disconnect()
+            if not self._stopped.wait(delay):
+                self.reconnects += 1
+                delay = min(delay * 2, SUBSCRIBE_RETRY_MAX_SECONDS)
+
+    def _disconnect(self):
+        self._subscribed.clear()
+        response, self._response = self._response, None
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+    def _reset(self):
+        self._frameworks = {}
+        self._completed_frameworks = {}
+        self._agents = {}
+        self._tasks = {}
+        self._completed_tasks = {}
+        self._state = None
+
+    def _handle(self, event):
+        kind = event.get('type')
+        self._last_event = time.time()
+        self.events += 1
+
+        with self._lock:
+            if kind == 'SUBSCRIBED':
+                subscribed = event['subscribed']
+                self._heartbeat = subscribed.get('heartbeat_interval_seconds', self._heartbeat)
+                self._load(subscribed.get('get_state', {}))
+                self._subscribed.set()
+            elif kind == 'TASK_ADDED':
+                self._add_task(event['task_added']['task'])
+            elif kind == 'TASK_UPDATED':
+                self._update_task(event['task_updated'])
+            elif kind in ('FRAMEWORK_ADDED', 'FRAMEWORK_UPDATED'):
+                framework = _framework(event[kind.lower()]['framework'])
+                self._frameworks[framework['id']] = framework
+            elif kind == 'FRAMEWORK_REMOVED':
+                framework_id = event['framework_removed']['framework_info']['id']['value']
+                framework = self._frameworks.pop(framework_id, None)
+                if framework is not None:
+                    framework['active'] = False
+                    self._completed_frameworks[framework_id] = framework
+            elif kind == 'AGENT_ADDED':
+                agent = _agent(event['agent_added']['agent'])
+                self._agents[agent['id']] = agent
+            elif kind == 'AGENT_REMOVED':
+                self._agents.pop(event['agent_removed']['agent_id']['value'], None)
+            else:
+                # HEARTBEAT, and events which don't change the model
+                return
+            self._state = None
+
+    def _load(self, get_state):
+        self._reset()
+        frameworks = get_state.get('get_frameworks', {})
+        for framework in frameworks.get('frameworks', []):
+            framework = _framework(framework)
+            self._frameworks[framework['id']] = framework
+        for framework in frameworks.get('completed_frameworks', []):
+            framework = _framework(framework)
+            self._completed_frameworks[framework['id']] = framework
+
+        for agent in get_state.get('get_agents', {}).get('agents', []):
+            agent = _agent(agent)
+            self._agents[agent['id']] = agent
+
+        tasks = get_state.get('get_tasks', {})
+        for key in ('pending_tasks', 'tasks', 'unreachable_tasks', 'completed_tasks'):
+            for task in tasks.get(key, []):
+                self._add_task(task)
+
+    def _add_task(self, task):
+        task = _task(task)
+        key = (task['framework_id'], task['id'])
+        if task['state'] in COMPLETED_TASK_STATES:
+            self._tasks.pop(key, None)
+            self._completed_tasks[key] = task
+        else:
+            self._tasks[key] = task
+
+    def _update_task(self, update):
+        status = update['status']
+        key = (update['framework_id']['value'], status['task_id']['value'])
+        task = self._tasks.get(key) or self._completed_tasks.get(key)
+        if task is None:
+            return
+        task['state'] = update['state']
+        task['statuses'].append(_status(status))
+        if task['state'] in COMPLETED_TASK_STATES and key in self._tasks:
+            self._completed_tasks[key] = self._tasks.pop(key)
+
+    def _build_state(self):
+        frameworks = {}
+        for framework_id, framework in list(self._completed_frameworks.items()) + list(self._frameworks.items()):
+            frameworks[framework_id] = dict(framework, tasks=[], completed_tasks=[])
+        for key, tasks in (('tasks', self._tasks), ('completed_tasks', self._completed_tasks)):
+            for (framework_id, _), task in tasks.items():
+                if framework_id in frameworks:
+                    frameworks[framework_id][key].append(dict(task, statuses=list(task['statuses'])))
+
+        return {
+            'frameworks': [frameworks[i] for i in self._frameworks],
+            'completed_frameworks': [frameworks[i] for i in self._completed_frameworks],
+            'slaves': [dict(agent) for agent in self._agents.values()],
+        }
+
+
+def _value(message, name):
+    return message.get(name, {}).get('value')
+
+
+def _resources(resources):
+    """ Operator API resources as the `/state` dict of name to amount """
+    result = {}
+    for resource in resources:
+        name = resource['name']
+        if 'scalar' in resource:
+            result[name] = result.get(name, 0) + resource['scalar']['value']
+        elif 'ranges' in resource:
+            ranges = ', '.join('{}-{}'.format(r['begin'], r['end']) for r in resource['ranges'].get('range', []))
+            result[name] = '[{}]'.format(ranges)
+    return result
+
+
+def _labels(labels):
+    return labels.get('labels', []) if isinstance(labels, dict) else labels
+
+
+def _status(status):
+    result = {k: v for k, v in status.items() if k not in ('task_id', 'agent_id', 'executor_id', 'uuid')}
+    if 'labels' in result:
+        result['labels'] = _labels(result['labels'])
+    return result
+
+
+def _task(task):
+    result = {k: v for k, v in task.items()
+              if k not in ('task_id', 'framework_id', 'executor_id', 'agent_id', 'resources', 'statuses', 'labels')}
+    result.update({
+        'id': task['task_id']['value'],
+        'framework_id': task['framework_id']['value'],
+        'executor_id': _value(task, 'executor_id') or '',
+        'slave_id': _value(task, 'agent_id'),
+        'state': task.get('state', 'TASK_STAGING'),
+        'resources': _resources(task.get('resources', [])),
+        'statuses': [_status(s) for s in task.get('statuses', [])],
+    })
+    if 'labels' in task:
+        result['labels'] = _labels(task['labels'])
+    return result
+
+
+def _framework(framework):
+    info = framework['framework_info']
+    result = {k: v for k, v in info.items() if k not in ('id', 'capabilities', 'labels')}
+    result.update({
+        'id': info['id']['value'],
+        'name': info['name'],
+        'active': framework.get('active', False),
+        'connected': framework.get('connected', False),
+    })
+    return result
+
+
+def _agent(agent):
+    info = agent['agent_info']
+    return {
+        'id': info['id']['value'],
+        'hostname': info['hostname'],
+        'port': info.get('port'),
+        'pid': agent.get('pid'),
+        'active': agent.get('active', False),
+        'version': agent.get('version'),
+        'resources': _resources(agent.get('total_resources', info.get('resources', []))),
+        'used_resources': _resources(agent.get('allocated_resources', [])),
+    }
+
+
+_subscriber = None
+
+
+def start_state_subscriber(url=None):
+    """ Keep the master state current from the operator API event stream in
+        the background, so that the service and task helpers stop polling
+        `/state`.  While the stream is unavailable they poll as before.
+
+        :param url: the operator API endpoint; defaults to the master's `api/v1`
+        :type url: str
+
+        :return: the running subscriber
+        :rtype: MasterStateSubscriber
+    """
+    global _subscriber
+
+    stop_state_subscriber()
+    _subscriber = MasterStateSubscriber(url).start()
+    set_live_state(_subscriber)
+    return _subscriber
+
+
+def stop_state_subscriber():
+    """ Stop the subscriber started by `start_state_subscriber`, returning to polling
+    """
+    global _subscriber
+
+    if _subscriber is not None:
+        set_live_state(None)
+        _subscriber.stop()
+        _subscriber = None
+
+
+def events_request(url, timeout):
+    """ Open a server-sent events stream
+
+        :param url: the event stream endpoint
+        :type url: str
+        :param timeout: (connect, read) timeouts in seconds
+        :type timeout: tuple
+
+        :return: the streaming response
+        :rtype: requests.Response
+    """
+    return http.get(url,
+                    headers={'Accept': 'text/event-stream'},
+                    stream=True,
+                    timeout=timeout)
+
+
+def sse_events(lines):
+    """ Decode server-sent events from lines of text as they arrive,
+        yielding the (event type, data) of each
+    """
+    kind, data = None, []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line:
+            if data or kind:
+                yield kind or 'message', '\n'.join(data)
+            kind, data = None, []
+        elif line.startswith(':'):
+            continue
+        else:
+            field, _, value = line.partition(':')
+            value = value[1:] if value.startswith(' ') else value
+            if field == 'event':
+                kind = value
+            elif field == 'data':
+                data.append(value)
+
+
+class MarathonEventStream:
+    """ Follows Marathon's event stream, counting the events of each type,
+        reconnecting whenever the stream drops.
+
+        :param url: the event stream endpoint; defaults to Marathon's `v2/events`
+        :type url: str
+        :param request: opens the stream, as `events_request` does
+        :type request: function
+    """
+
+    def __init__(self, url=None, request=events_request):
+        self.url = url or urljoin(dcos_service_url('marathon'), 'v2/events')
+        self.request = request
+        self.events = 0
+        self.reconnects = 0
+        self._condition = threading.Condition()
+        self._counts = defaultdict(int)
+        self._drops = 0
+        self._connected = False
+        self._stopped = threading.Event()
+        self._response = None
+        self._thread = None
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='marathon-events', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._disconnect()
+
+    def wait_connected(self, timeout=None):
+        """ Block until the stream is open
+
+            :return: True if connected, False on timeout
+            :rtype: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._connected, timeout)
+
+    def wakeup(self, *event_types):
+        """ An `EventWakeup` for waiters which should wake on these event types
+        """
+        return EventWakeup(self, event_types)
+
+    def generation(self, event_types):
+        """ A number which changes whenever one of these event types arrives,
+            or the stream drops
+        """
+        with self._condition:
+            return sum(self._counts[kind] for kind in event_types) + self._drops
+
+    def _run(self):
+        delay = SUBSCRIBE_RETRY_SECONDS
+        while not self._stopped.is_set():
+            try:
+                # Marathon's stream can be quiet for a long time, so there is no read timeout
+                self._response = self.request(self.url, (5, None))
+                self._set_connected(True)
+                delay = SUBSCRIBE_RETRY_SECONDS
+                for kind, _ in sse_events(self._response.iter_lines(chunk_size=None)):
+                    self._notify(kind)
+                    if self._stopped.is_set():
+                        break
+            except Exception:
+                pass
+            self._disconnect()
+            if not self._stopped.wait(delay):
+                self.reconnects += 1
+                delay = min(delay * 2, SUBSCRIBE_RETRY_MAX_SECONDS)
+
+    def _set_connected(self, connected):
+        with self._condition:
+            if self._connected and not connected:
+                # wake every waiter, so that it goes back to polling
+                self._drops += 1
+            self._connected = connected
+            self._condition.notify_all()
+
+    def _notify(self, kind):
+        with self._condition:
+            self.events += 1
+            self._counts[kind] += 1
+            self._condition.notify_all()
+
+    def _disconnect(self):
+        self._set_connected(False)
+        response, self._response = self._response, None
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+
+
+class EventWakeup:
+    """ Sleeps a waiter between ticks until one of `event_types` arrives on
+        the stream, or for the waiter's usual interval, whichever is sooner.
+        Create it before the waiter's first check, so that no event is missed.
+
+        :param stream: the event stream
+        :type stream: MarathonEventStream
+        :param event_types: the event types to wake on, such as 'status_update_event'
+        :type event_types: tuple
+    """
+
+    def __init__(self, stream, event_types):
+        self.stream = stream
+        self.event_types = event_types
+        self._seen = stream.generation(event_types)
+
+    def wait(self, seconds, remaining=None):
+        """ Sleep until a matching event arrives, or for seconds.  When woken
+            by an event, the shared master state snapshot is dropped, so that
+            the waiter's next check sees the change the event announced.
+
+            :param seconds: the waiter's polling interval
+            :type seconds: float
+            :param remaining: the seconds left before the waiter times out, or None
+            :type remaining: float
+
+            :return: True if woken by an event
+            :rtype: bool
+        """
+        stream = self.stream
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+
+        with stream._condition:
+            woken = stream._condition.wait_for(lambda: stream.generation(self.event_types) != self._seen, seconds)
+            self._seen = stream.generation(self.event_types)
+        if woken:
+            invalidate_state_cache()
+        return woken
+
+
+_marathon_events = None
+
+
+def start_marathon_events(url=None):
+    """ Follow Marathon's event stream in the background, so that
+        `deployment_wait()` and the Marathon task waiters wake as soon as a
+        deployment finishes or a task changes state, rather than on their
+        next one-second tick.  While the stream is unavailable they poll as
+        before.
+
+        :param url: the event stream endpoint; defaults to Marathon's `v2/events`
+        :type url: str
+
+        :return: the running stream
+        :rtype: MarathonEventStream
+    """
+    global _marathon_events
+
+    stop_marathon_events()
+    _marathon_events = MarathonEventStream(url).start()
+    return _marathon_events
+
+
+def stop_marathon_events():
+    """ Stop the stream started by `start_marathon_events`, returning the waiters to polling
+    """
+    global _marathon_events
+
+    if _marathon_events is not None:
+        _marathon_events.stop()
+        _marathon_events = None
+
+
+def marathon_event_wakeup(*event_types):
+    """ An `EventWakeup` on the stream started by `start_marathon_events`
+
+        :return: the wakeup, or None if the stream isn't running
+        :rtype: EventWakeup
+    """
+    stream = _marathon_events
+    if stream is None:
+        return None
+    return stream.wakeup(*event_types)
@@ -1,10 +1,25 @@
+import hashlib
 import os
-import scp
+import posixpath
+import shlex
+import stat
+import tarfile
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-from shakedown.dcos.helpers import *
+import paramiko
 
 import shakedown
+from shakedown.dcos.command import _get_connection, run_command, run_command_on_hosts
+from shakedown.dcos.helpers import *
+
+# SFTP flow-control window; large enough to keep a high-latency, proxied
+# link busy with many outstanding requests.
+SFTP_WINDOW_SIZE = 64 * 1024 * 1024
+# the largest read or write paramiko issues in a single SFTP request
+SFTP_CHUNK_SIZE = 32768
 
 
 def copy_file(
@@ -15,7 +30,9 @@ def copy_file(
         key_path=None,
         action='put'
 ):
-    """ Copy a file via SCP, proxied through the mesos master
+    """ Copy a file via SFTP, proxied through the mesos master.  The cached
+        SSH connection to the host is reused and reads and writes are
+        pipelined.
 
         :param host: host or IP of the machine to execute the command on
         :type host: str
@@ -32,38 +49,324 @@ def copy_file(
         :rtype: bool
     """
 
-    if not username:
-        username = shakedown.cli.ssh_user
+    with _get_connection.lease(host, username, key_path) as transport:
+        if transport is None:
+            return False
+
+        start = time.time()
+
+        sftp = paramiko.SFTPClient.from_transport(transport, window_size=SFTP_WINDOW_SIZE)
+        try:
+            if action == 'get':
+                print("\n{}scp {}:{} {}\n".format(shakedown.cli.helpers.fchr('>>'), host, remote_path, file_path))
+                size = _sftp_get(sftp, remote_path, file_path)
+            else:
+                print("\n{}scp {} {}:{}\n".format(shakedown.cli.helpers.fchr('>>'), file_path, host, remote_path))
+                size = _sftp_put(sftp, file_path, remote_path)
+        finally:
+            try_close(sftp)
+
+        elapsed = time.time() - start
+        print("{} bytes copied in {} seconds ({} bytes/sec).".format(
+            size, round(elapsed, 2), int(size / elapsed) if elapsed > 0 else size))
+
+        return True
+
+
+def _sftp_put(sftp, file_path, remote_path):
+    """ Upload a file, keeping its permissions, without waiting for each
+        write to be acknowledged.
+
+        :return: the number of bytes copied
+        :rtype: int
+    """
+    try:
+        if stat.S_ISDIR(sftp.stat(remote_path).st_mode):
+            remote_path = posixpath.join(remote_path, os.path.basename(file_path))
+    except IOError:
+        pass
+
+    size = 0
+    with open(file_path, 'rb') as src, sftp.open(remote_path, 'wb') as dst:
+        dst.set_pipelined(True)
+        while True:
+            chunk = src.read(SFTP_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+            size += len(chunk)
+    sftp.chmod(remote_path, stat.S_IMODE(os.stat(file_path).st_mode))
+
+    return size
+
+
+def _sftp_get(sftp, remote_path, file_path):
+    """ Download a file, requesting all of it up front rather than one
+        chunk at a time.
+
+        :return: the number of bytes copied
+        :rtype: int
+    """
+    if os.path.isdir(file_path):
+        file_path = os.path.join(file_path, posixpath.basename(remote_path))
+
+    size = 0
+    with sftp.open(remote_path, 'rb') as src, open(file_path, 'wb') as dst:
+        src.prefetch(src.stat().st_size)
+        while True:
+            chunk = src.read(SFTP_CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+            size += len(chunk)
+
+    return size
+
+
+def broadcast_file(
+        file_path,
+        hosts,
+        remote_path='.',
+        username=None,
+        key_path=None,
+        port=7778,
+        max_workers=16
+):
+    """ Copy a file to many hosts while uploading it from here only once.  The
+        file is copied to the master and served from there over HTTP, on the
+        master's private IP at a random path, until every host has fetched
+        it concurrently and its checksum is verified.
+
+        :param file_path: the local path to the file to be copied
+        :type file_path: str
+        :param hosts: hosts or IPs of the machines to copy the file to
+        :type hosts: [str]
+        :param remote_path: the remote path to copy the file to
+        :type remote_path: str
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+        :param port: port on the master to serve the file from
+        :type port: int
+        :param max_workers: maximum number of hosts to copy the file to at once
+        :type max_workers: int
+
+        :return: a mapping of host to True if the file arrived intact, False otherwise
+        :rtype: dict
+    """
+
+    checksum = _sha256(file_path)
+    name = os.path.basename(file_path)
+    # the file is served only from a random path, on the master's private
+    # address, from a directory only the SSH user can read
+    token = uuid.uuid4().hex
+    staging = 'shakedown-broadcast-{}'.format(token)
+    master = shakedown.master_ip()
+    pid = None
+
+    try:
+        success, address = run_command(master, '/opt/mesosphere/bin/detect_ip', username, key_path, False)
+        address = address.strip()
+        if not success or not address:
+            print("error: unable to detect the private IP of the master {}".format(master))
+            return {host: False for host in hosts}
+
+        # an empty index.html stops the server listing the token directory
+        run_command(master, '(umask 077 && mkdir -p {d}/{t} && touch {d}/index.html)'.format(d=staging, t=token),
+                    username, key_path, False)
+        if not copy_file(master, file_path, '{}/{}'.format(staging, token), username, key_path):
+            return {host: False for host in hosts}
+
+        success, pid = run_command(
+            master,
+            'cd {d} && (nohup /opt/mesosphere/bin/python -m http.server --bind {a} {p} > /dev/null 2>&1 & echo $!) && '
+            'for i in $(seq 50); do curl -sf -o /dev/null http://{a}:{p}/ && break; sleep 0.1; done'.format(
+                d=staging, a=address, p=port),
+            username, key_path, False)
+
+        url = 'http://{}:{}/{}/{}'.format(address, port, token, name)
+        fetch = 'dest={d}; if [ -d "$dest" ]; then dest="$dest"/{n}; fi; ' \
+                'curl -fsS -o "$dest" {u} && sha256sum "$dest"'.format(
+                    d=shlex.quote(remote_path), n=shlex.quote(name), u=shlex.quote(url))
+        results = run_command_on_hosts(hosts, fetch, username, key_path, max_workers=max_workers)
+    finally:
+        stop = 'rm -rf {}'.format(staging)
+        if pid and pid.strip().isdigit():
+            stop = 'kill {}; {}'.format(pid.strip(), stop)
+        run_command(master, stop, username, key_path, False)
+
+    return {host: success and output.split()[:1] == [checksum]
+            for host, (success, output, duration) in results.items()}
+
+
+def sync_tree(
+        local_dir,
+        host,
+        remote_dir,
+        username=None,
+        key_path=None
+):
+    """ Bring a remote directory up to date with a local one.  Only files
+        whose checksum differs from the remote copy are sent, as a single
+        compressed tar stream.  Remote files which don't exist locally are
+        left alone.
+
+        :param local_dir: the local directory to copy
+        :type local_dir: str
+        :param host: host or IP of the machine to copy the directory to
+        :type host: str
+        :param remote_dir: the remote directory to update
+        :type remote_dir: str
+        :param username: SSH username
+        :type username: str
+        :param key_path: path to the SSH private key to use for SSH authentication
+        :type key_path: str
+
+        :return: the relative paths of the files sent, or None if the sync failed
+        :rtype: [str]
+    """
+
+    return _sync_tree(local_dir, _tree_checksums(local_dir), host, remote_dir, username, key_path)
+
+
+def sync_tree_to_hosts(
+        local_dir,
+        hosts,
+        remote_dir,
+        username=None,
+        key_path=None,
+        max_workers=16
+):
+    """ Bring a remote directory on many hosts up to date with a local one,
+        concurrently.  See `sync_tree`.
+
+        :return: a mapping of host to the relative paths of the files sent, or None if the sync failed
+        :rtype: OrderedDict
+    """
+
+    checksums = _tree_checksums(local_dir)
+    hosts = list(OrderedDict.fromkeys(hosts))
+    results = OrderedDict()
+
+    if not hosts:
+        return results
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(hosts))) as executor:
+        futures = [(host, executor.submit(_sync_tree, local_dir, checksums, host, remote_dir, username, key_path))
+                   for host in hosts]
+        for host, future in futures:
+            try:
+                results[host] = future.result()
+            except Exception as e:
+                results[host] = _sync_failed(local_dir, host, remote_dir, e)
+
+    return results
+
+
+def _sync_failed(local_dir, host, remote_dir, reason):
+    print("error: unable to sync {} to {}:{}: {}".format(local_dir, host, remote_dir, reason))
+    return None
+
+
+def _sync_tree(local_dir, checksums, host, remote_dir, username, key_path):
+    # a missing directory lists no files; any other failure fails the sync,
+    # rather than looking like an empty tree
+    success, output = run_command(
+        host,
+        'if [ -d {d} ]; then cd {d} && find . -type f -exec sha256sum {{}} +; fi'.format(
+            d=shlex.quote(remote_dir)),
+        username, key_path, False)
+    if not success:
+        return _sync_failed(local_dir, host, remote_dir, output.strip())
+
+    remote = {}
+    for line in output.splitlines():
+        checksum, _, path = line.partition('  ')
+        remote[posixpath.normpath(path)] = checksum
 
-    if not key_path:
-        key_path = shakedown.cli.ssh_key_file
+    changed = [path for path, checksum in checksums.items() if remote.get(path) != checksum]
 
-    key = validate_key(key_path)
+    print("\n{}sync {} {}:{} ({} of {} files changed)\n".format(
+        shakedown.cli.helpers.fchr('>>'), local_dir, host, remote_dir, len(changed), len(checksums)))
 
-    transport = get_transport(host, username, key)
-    transport = start_transport(transport, username, key)
+    if not changed:
+        return changed
+
+    with _get_connection.lease(host, username, key_path) as transport:
+        if not transport:
+            return _sync_failed(local_dir, host, remote_dir, 'unable to connect to {}'.format(host))
 
-    if transport.is_authenticated():
         start = time.time()
+        channel = transport.open_session()
+        try:
+            channel.exec_command('mkdir -p {d} && tar -xzf - -C {d}'.format(d=shlex.quote(remote_dir)))
+            writer = _ChannelWriter(channel)
+            with tarfile.open(fileobj=writer, mode='w|gz') as tar:
+                for path in changed:
+                    tar.add(os.path.join(local_dir, path), arcname=path)
+            channel.shutdown_write()
+            exit_code = channel.recv_exit_status()
+        finally:
+            try_close(channel)
 
-        channel = scp.SCPClient(transport)
+        print("{} bytes sent in {} seconds.".format(writer.count, round(time.time() - start, 2)))
 
-        if action == 'get':
-            print("\n{}scp {}:{} {}\n".format(shakedown.cli.helpers.fchr('>>'), host, remote_path, file_path))
-            channel.get(remote_path, file_path)
-        else:
-            print("\n{}scp {} {}:{}\n".format(shakedown.cli.helpers.fchr('>>'), file_path, host, remote_path))
-            channel.put(file_path, remote_path)
+        if exit_code != 0:
+            return _sync_failed(local_dir, host, remote_dir, 'tar exited with status {}'.format(exit_code))
+        return changed
 
-        print("{} bytes copied in {} seconds.".format(str(os.path.getsize(file_path)), str(round(time.time() - start, 2))))
 
-        try_close(channel)
-        try_close(transport)
+def _tree_checksums(local_dir):
+    """ The checksum of every file below local_dir, by relative path
+    """
+    checksums = {}
+    for root, dirs, files in os.walk(local_dir):
+        for name in files:
+            file_path = os.path.join(root, name)
+            path = os.path.relpath(file_path, local_dir).replace(os.sep, '/')
+            checksums[path] = _sha256(file_path)
+    return checksums
 
-        return True
-    else:
-        print("error: unable to authenticate {}@{} with key {}".format(username, host, key_path))
-        return False
+
+class _ChannelWriter(object):
+    """ A write-only file object over a channel's stdin, counting the bytes sent
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.count = 0
+
+    def write(self, data):
+        self.channel.sendall(data)
+        self.count += len(data)
+        return len(data)
+
+
+def _sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def copy_file_async(
+        host,
+        file_path,
+        remote_path='.',
+        username=None,
+        key_path=None,
+        action='put'
+):
+    """ Copy a file via SFTP, proxied through the mesos master, without
+        blocking the event loop.  Takes the same parameters as `copy_file`.
+
+        :return: True if successful, False otherwise
+        :rtype: bool
+    """
+
+    return await run_in_ssh_executor(copy_file, host, file_path, remote_path, username, key_path, action)
 
 
 def copy_file_to_master(
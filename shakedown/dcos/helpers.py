@@ -1,15 +1,178 @@
+import asyncio
+import functools
+import itertools
 import os
+import socket
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
 import paramiko
 import scp
-
 from dcos import http
 
-import itertools
 import shakedown
 
 
+# seconds to wait for the master to open a channel to an agent
+MASTER_CHANNEL_TIMEOUT = 30
+
+
+class MasterGateway(object):
+    """ A single authenticated transport to the master, shared by every
+        connection that has to be proxied through it.  Channels to agents are
+        multiplexed over this transport rather than each paying for its own
+        key exchange and authentication with the master.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._transport = None
+        self._identity = None
+        self._channels = weakref.WeakSet()
+        self.reconnects = 0
+
+    def _connected(self, identity):
+        transport = self._transport
+        return transport is not None and self._identity == identity \
+            and transport.is_active() and transport.is_authenticated()
+
+    def get_transport(self, username, key):
+        """ Return the shared master transport, (re)connecting it if required
+
+            :param username: SSH username
+            :type username: str
+            :param key: key object used for authentication
+            :type key: paramiko.RSAKey
+
+            :return: an authenticated transport to the master
+            :rtype: paramiko.Transport
+        """
+
+        from shakedown.dcos.command import _get_connection
+
+        master = shakedown.master_ip()
+        identity = (master, username)
+
+        with self._lock:
+            if not self._connected(identity):
+                if self._transport is not None:
+                    try_close(self._transport)
+                    self.reconnects += 1
+                self._transport = None
+                self._channels = weakref.WeakSet()
+
+                transport = paramiko.Transport(master)
+                try:
+                    start_transport(transport, username, key, master)
+                except Exception:
+                    try_close(transport)
+                    raise
+                # the same keepalives as cached connections, so that a dead
+                # master is noticed rather than hanging every agent connection
+                keepalive = _get_connection.settings()['keepalive']
+                if keepalive:
+                    transport.set_keepalive(keepalive)
+                self._transport = transport
+                self._identity = identity
+
+            return self._transport
+
+    def open_channel(self, host, username, key):
+        """ Open a channel to `host` port 22 through the master.  A dropped
+            master connection, or one which doesn't open the channel within
+            `MASTER_CHANNEL_TIMEOUT` seconds, is re-established once before
+            giving up.
+
+            :param host: the hostname to connect to
+            :type host: str
+            :param username: SSH username
+            :type username: str
+            :param key: key object used for authentication
+            :type key: paramiko.RSAKey
+
+            :return: a direct-tcpip channel to the host
+            :rtype: paramiko.Channel
+        """
+
+        for attempt in range(2):
+            transport = self.get_transport(username, key)
+            try:
+                channel = transport.open_channel('direct-tcpip', (host, 22), ('127.0.0.1', 0),
+                                                 timeout=MASTER_CHANNEL_TIMEOUT)
+            except paramiko.ChannelException:
+                # the master is fine but couldn't reach the host
+                raise
+            except (paramiko.SSHException, EOFError, socket.error):
+                # the master transport is dead or has stopped answering
+                try_close(transport)
+                if attempt:
+                    raise
+                continue
+
+            with self._lock:
+                self._channels.add(channel)
+            return channel
+
+    def channel_count(self):
+        """ The number of open channels currently carried by the gateway
+
+            :return: number of open channels
+            :rtype: int
+        """
+
+        with self._lock:
+            return len([c for c in self._channels if not c.closed])
+
+    def close(self):
+        """ Close the shared master transport and every channel it carries
+        """
+
+        with self._lock:
+            if self._transport is not None:
+                try_close(self._transport)
+            self._transport = None
+            self._identity = None
+            self._channels = weakref.WeakSet()
+
+
+master_gateway = MasterGateway()
+
+# the most blocking SSH operations the async API runs at once
+ASYNC_SSH_WORKERS = 32
+_ssh_executor = None
+_executor_lock = threading.Lock()
+
+
+def ssh_executor():
+    """ The thread pool shared by the async SSH functions.  Coroutines awaiting
+        SSH work cost nothing while they wait; only this many operations
+        block a thread at any one time.
+
+        :return: the shared executor
+        :rtype: concurrent.futures.ThreadPoolExecutor
+    """
+    global _ssh_executor
+
+    with _executor_lock:
+        if _ssh_executor is None:
+            _ssh_executor = ThreadPoolExecutor(max_workers=ASYNC_SSH_WORKERS)
+        return _ssh_executor
+
+
+async def run_in_ssh_executor(func, *args, **kwargs):
+    """ Run a blocking SSH operation on the shared executor without blocking
+        the event loop.
+
+        :return: the result of func
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(ssh_executor(), functools.partial(func, *args, **kwargs))
+
+
 def get_transport(host, username, key):
-    """ Create a transport object
+    """ Create a transport object.  Transports to hosts other than the master
+        are tunnelled over the shared `master_gateway` transport.
 
         :param host: the hostname to connect to
         :type host: str
@@ -22,19 +185,17 @@ def get_transport(host, username, key):
         :rtype: paramiko.Transport
     """
 
-    if host == shakedown.master_ip():
+    master = shakedown.master_ip()
+
+    if host == master:
         transport = paramiko.Transport(host)
     else:
-        transport_master = paramiko.Transport(shakedown.master_ip())
-        transport_master = start_transport(transport_master, username, key)
-
-        if not transport_master.is_authenticated():
-            print("error: unable to authenticate {}@{} with key {}".format(username, shakedown.master_ip(), key))
-            return False
-
         try:
-            channel = transport_master.open_channel('direct-tcpip', (host, 22), ('127.0.0.1', 0))
-        except paramiko.SSHException:
+            channel = master_gateway.open_channel(host, username, key)
+        except ValueError:
+            print("error: unable to authenticate {}@{} with key {}".format(username, master, key))
+            return False
+        except (paramiko.SSHException, EOFError, socket.error):
             print("error: unable to connect to {}".format(host))
             return False
 
@@ -43,8 +204,10 @@ def get_transport(host, username, key):
     return transport
 
 
-def start_transport(transport, username, key):
-    """ Begin a transport client and authenticate it
+def start_transport(transport, username, key, host=None):
+    """ Begin a transport client and authenticate it.  The identity that
+        last authenticated `host` (or, failing that, any host as `username`)
+        is tried first.
 
         :param transport: the transport object to start
         :type transport: paramiko.Transport
@@ -52,6 +215,8 @@ def start_transport(transport, username, key):
         :type username: str
         :param key: key object used for authentication
         :type key: paramiko.RSAKey
+        :param host: the host the transport connects to, used to remember the working key
+        :type host: str
 
         :return: the transport object passed
         :rtype: paramiko.Transport
@@ -59,9 +224,7 @@ def start_transport(transport, username, key):
 
     transport.start_client()
 
-    agent = paramiko.agent.Agent()
-    keys = itertools.chain((key,) if key else (), agent.get_keys())
-    for test_key in keys:
+    for test_key in _candidate_keys(host, username, key):
         try:
             transport.auth_publickey(username, test_key)
             break
@@ -70,9 +233,79 @@ def start_transport(transport, username, key):
     else:
         raise ValueError('No valid key supplied')
 
+    with _key_lock:
+        _working_keys[(host, username)] = test_key.get_fingerprint()
+        _working_keys[(None, username)] = test_key.get_fingerprint()
+
     return transport
 
 
+_key_lock = threading.RLock()
+# path -> (mtime, parsed key)
+_parsed_keys = {}
+# (host, username) -> fingerprint of the key that last authenticated
+_working_keys = {}
+_ssh_agent = None
+
+
+class _SerialAgent(paramiko.agent.Agent):
+    """ An ssh-agent connection which sends one request at a time.  Every
+        connection signs with the same agent connection, and they
+        authenticate in parallel; paramiko doesn't lock the agent socket, so
+        their requests and replies would otherwise interleave.
+    """
+
+    def __init__(self):
+        # the lock has to exist before the agent is asked for its keys
+        self._request_lock = threading.Lock()
+        super(_SerialAgent, self).__init__()
+
+    def _send_message(self, msg):
+        with self._request_lock:
+            return super(_SerialAgent, self)._send_message(msg)
+
+
+def _agent_keys():
+    """ Keys held by the ssh-agent, fetched once per process
+    """
+    global _ssh_agent
+
+    with _key_lock:
+        if _ssh_agent is None:
+            _ssh_agent = _SerialAgent()
+        return _ssh_agent.get_keys()
+
+
+def _candidate_keys(host, username, key):
+    """ The keys to try when authenticating, in order and without duplicates
+    """
+    keys = []
+    seen = set()
+    for test_key in itertools.chain((key,) if key else (), _agent_keys()):
+        fingerprint = test_key.get_fingerprint()
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            keys.append(test_key)
+
+    with _key_lock:
+        preferred = _working_keys.get((host, username), _working_keys.get((None, username)))
+    keys.sort(key=lambda k: k.get_fingerprint() != preferred)
+    return keys
+
+
+def clear_key_cache():
+    """ Forget parsed keys, ssh-agent keys and the keys that worked for each host
+    """
+    global _ssh_agent
+
+    with _key_lock:
+        _parsed_keys.clear()
+        _working_keys.clear()
+        if _ssh_agent is not None:
+            _ssh_agent.close()
+        _ssh_agent = None
+
+
 # SSH connection will be auto-terminated at the conclusion of this operation, causing
 # a race condition; the try/except block attempts to close the channel and/or transport
 # but does not issue a failure if it has already been closed.
@@ -84,7 +317,7 @@ def try_close(obj):
 
 
 def validate_key(key_path):
-    """ Validate a key
+    """ Validate a key.  Parsed keys are cached until the key file changes.
 
         :param key_path: path to a key to use for authentication
         :type key_path: str
@@ -98,4 +331,10 @@ def validate_key(key_path):
     if not os.path.isfile(key_path):
         return False
 
-    return paramiko.RSAKey.from_private_key_file(key_path)
+    mtime = os.path.getmtime(key_path)
+    with _key_lock:
+        cached = _parsed_keys.get(key_path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, paramiko.RSAKey.from_private_key_file(key_path))
+            _parsed_keys[key_path] = cached
+        return cached[1]
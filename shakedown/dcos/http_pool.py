@@ -0,0 +1,129 @@
+""" A shared, pooled HTTP session for every request made through `dcos.http`.
+
+    The DC/OS library sends each request with `requests.request`, which
+    builds a new session, and so a new TCP connection and TLS handshake, every
+    time.  Installing the pool routes those requests through one keep-alive
+    session instead, and records how many requests go to each host and how
+    long they take.
+"""
+import time
+from http.cookiejar import DefaultCookiePolicy
+from threading import RLock
+from urllib.parse import urlparse
+
+import requests
+from dcos import http
+from requests.adapters import HTTPAdapter
+
+
+# the number of hosts to keep connections to, and the connections kept per host
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = 32
+
+_session = None
+_adapter = None
+_stats = {}
+_stats_lock = RLock()
+
+
+class _PooledRequests:
+    """Stands in for the `requests` module inside `dcos.http`, sending
+    requests through the shared session."""
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+    def request(self, method, url, **kwargs):
+        host = urlparse(url).netloc
+        start = time.time()
+        error = True
+        try:
+            response = _session.request(method=method, url=url, **kwargs)
+            error = False
+            return response
+        finally:
+            _record(host, time.time() - start, error)
+
+
+def configure_http_pool(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, keep_alive=True):
+    """ Route every `dcos.http` request through a new shared session, closing
+        any previous one.
+
+        :param pool_connections: the number of hosts to keep connections to
+        :type pool_connections: int
+        :param pool_maxsize: the number of connections kept to each host
+        :type pool_maxsize: int
+        :param keep_alive: whether to reuse connections between requests
+        :type keep_alive: bool
+    """
+    global _session, _adapter
+
+    session = requests.Session()
+    # like requests.request, don't carry cookies from one request to the next
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    previous, _session, _adapter = _session, session, adapter
+    http.requests = _PooledRequests()
+    if previous is not None:
+        previous.close()
+
+
+def http_stats():
+    """ The HTTP requests made through the pool since it was last reset, by host
+
+        :return: a mapping of host to a dict of `requests`, `errors`, `time` and
+            `max_time` in seconds, and `connections` opened to the host
+        :rtype: dict
+    """
+    with _stats_lock:
+        stats = {host: dict(s) for host, s in _stats.items()}
+
+    for host, connections in _connections().items():
+        stats.setdefault(host, _new_stats())['connections'] = connections
+
+    return stats
+
+
+def reset_http_stats():
+    """ Forget the HTTP requests recorded so far
+    """
+    with _stats_lock:
+        _stats.clear()
+
+
+def _new_stats():
+    return {'requests': 0, 'errors': 0, 'time': 0.0, 'max_time': 0.0, 'connections': 0}
+
+
+def _record(host, duration, error):
+    with _stats_lock:
+        stats = _stats.setdefault(host, _new_stats())
+        stats['requests'] += 1
+        stats['errors'] += int(error)
+        stats['time'] += duration
+        stats['max_time'] = max(stats['max_time'], duration)
+
+
+def _connections():
+    """The number of connections opened by each host's pool."""
+    if _adapter is None:
+        return {}
+
+    pools = _adapter.poolmanager.pools
+    connections = {}
+    for key in pools.keys():
+        pool = pools[key]
+        if pool is None:
+            continue
+        host = pool.host if pool.port in (None, 80, 443) else '{}:{}'.format(pool.host, pool.port)
+        connections[host] = connections.get(host, 0) + pool.num_connections
+    return connections
+
+
+configure_http_pool()
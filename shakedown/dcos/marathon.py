@@ -1,5 +1,6 @@
 from distutils.version import LooseVersion
 from dcos import marathon, config
+from shakedown.dcos.events import marathon_event_wakeup
 from shakedown.dcos.spinner import *
 from shakedown.dcos.service import service_available_predicate
 from shakedown import *
@@ -69,7 +70,8 @@ def deployment_predicate(app_id=None):
 
 def deployment_wait(timeout=120, app_id=None):
     time_wait(lambda: deployment_predicate(app_id),
-              timeout)
+              timeout,
+              wakeup=marathon_event_wakeup('deployment_success', 'deployment_failed'))
 
 
 def delete_app(app_id, force=True):
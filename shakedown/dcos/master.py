@@ -22,19 +22,13 @@ def partition_master(incoming=True, outgoing=True):
 
     echo('Partitioning master. Incoming:{} | Outgoing:{}'.format(incoming, outgoing))
 
-    network.save_iptables(shakedown.master_ip())
-    network.flush_all_rules(shakedown.master_ip())
-    network.allow_all_traffic(shakedown.master_ip())
+    rules = []
+    if incoming:
+        rules.append(DISABLE_MASTER_INCOMING)
+    if outgoing:
+        rules.append(DISABLE_MASTER_OUTGOING)
 
-    if incoming and outgoing:
-        network.run_iptables(shakedown.master_ip(), DISABLE_MASTER_INCOMING)
-        network.run_iptables(shakedown.master_ip(), DISABLE_MASTER_OUTGOING)
-    elif incoming:
-        network.run_iptables(shakedown.master_ip(), DISABLE_MASTER_INCOMING)
-    elif outgoing:
-        network.run_iptables(shakedown.master_ip(), DISABLE_MASTER_OUTGOING)
-    else:
-        pass
+    network.partition_host(shakedown.master_ip(), rules)
 
 
 def reconnect_master():
@@ -47,7 +41,11 @@ def restart_master_node():
     """ Restarts the master node
     """
 
+    # results may be cached under the public master IP as well as the leader's private one
+    hosts = {master_ip(), master_leader_ip()}
     run_command_on_master("sudo /sbin/shutdown -r now")
+    for host in hosts:
+        invalidate_command_cache(host)
 
 
 def systemctl_master(command='restart'):
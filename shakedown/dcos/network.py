@@ -4,40 +4,65 @@
 """
 from shakedown import *
 
+RESTORE_IPTABLES = 'if [ -e iptables.rules ]; then sudo iptables-restore < iptables.rules && rm iptables.rules ; fi'
+SAVE_IPTABLES = 'if [ ! -e iptables.rules ] ; then sudo iptables -L > /dev/null && sudo iptables-save > iptables.rules ; fi'
+FLUSH_ALL_RULES = 'sudo iptables -F INPUT'
+ALLOW_ALL_TRAFFIC = 'sudo iptables --policy INPUT ACCEPT && sudo iptables --policy OUTPUT ACCEPT && sudo iptables --policy FORWARD ACCEPT'
+
 
 def restore_iptables(host):
     """ Reconnect a previously partitioned node to the network
         :param hostname: host or IP of the machine to partition from the cluster
     """
 
-    run_command_on_agent(host, 'if [ -e iptables.rules ]; then sudo iptables-restore < iptables.rules && rm iptables.rules ; fi')
+    run_command_on_agent(host, RESTORE_IPTABLES)
 
 
 def save_iptables(host):
     """ Saves iptables firewall rules such they can be restored
     """
 
-    run_command_on_agent(host, 'if [ ! -e iptables.rules ] ; then sudo iptables -L > /dev/null && sudo iptables-save > iptables.rules ; fi')
+    run_command_on_agent(host, SAVE_IPTABLES)
+
+
+def iptables_command(rule):
+    """ The command which applies an iptables rule such as
+        '-I INPUT -p tcp --dport 22 -j ACCEPT'.
+    """
+    return 'sudo iptables {}'.format(rule)
 
 
 def run_iptables(host, rule):
     """ iptables is challenging to abstract.  This function takes a rule
         '-I INPUT -p tcp --dport 22 -j ACCEPT' and runs it on the agent.
     """
-    ip_table_cmd = 'sudo iptables {}'.format(rule)
-    run_command_on_agent(host, ip_table_cmd)
+    run_command_on_agent(host, iptables_command(rule))
 
 
 def flush_all_rules(host):
     """ Flushes all the iptables rules
     """
-    run_command_on_agent(host, 'sudo iptables -F INPUT')
+    run_command_on_agent(host, FLUSH_ALL_RULES)
 
 
 def allow_all_traffic(host):
     """ Opens up iptables on host to allow all traffic
     """
-    run_command_on_agent(host, 'sudo iptables --policy INPUT ACCEPT && sudo iptables --policy OUTPUT ACCEPT && sudo iptables --policy FORWARD ACCEPT')
+    run_command_on_agent(host, ALLOW_ALL_TRAFFIC)
+
+
+def partition_host(host, rules):
+    """ Saves the iptables rules on host, flushes them, allows all traffic and
+        then applies each of rules, all in a single SSH round trip.
+
+        :param host: host or IP of the machine to partition
+        :param rules: iptables rules such as '-A INPUT -j REJECT', in order
+        :return: the result of each command
+        :rtype: [CommandResult]
+    """
+    commands = [SAVE_IPTABLES, FLUSH_ALL_RULES, ALLOW_ALL_TRAFFIC]
+    commands.extend(iptables_command(rule) for rule in rules)
+    return run_commands_on_agent(host, commands)
 
 
 @contextlib.contextmanager
@@ -1,8 +1,10 @@
 from dcos import (marathon, mesos, http)
 from shakedown.dcos.command import *
+from shakedown.dcos.events import marathon_event_wakeup
 from shakedown.dcos.spinner import *
 from shakedown.dcos import dcos_service_url, dcos_agents_state, master_url
 from shakedown.dcos.master import get_all_masters
+from shakedown.dcos.state import get_master_state, get_task_index
 from shakedown.dcos.zookeeper import delete_zk_node
 from dcos.errors import DCOSException, DCOSConnectionError, DCOSHTTPException
 
@@ -27,7 +29,7 @@ def get_service(
         :rtype: dict, or None
     """
 
-    services = mesos.get_master().frameworks(inactive=inactive, completed=completed)
+    services = mesos.Master(get_master_state()).frameworks(inactive=inactive, completed=completed)
 
     for service in services:
         if service['name'] == service_name:
@@ -125,7 +127,9 @@ def get_marathon_tasks(
 def get_mesos_tasks():
     """ Get a list of mesos tasks
     """
-    return mesos.get_master().tasks()
+    index = get_task_index()
+    master = mesos.Master(index.state)
+    return [mesos.Task(task, master) for task in index.tasks()]
 
 
 def get_service_task(
@@ -148,11 +152,12 @@ def get_service_task(
         :rtye: dict, or None
     """
 
-    service = get_service_tasks(service_name, inactive, completed)
+    index = get_task_index()
+    service = index.framework(service_name, inactive, completed)
 
     if service is not None:
-        for task in service:
-            if task['name'] == task_name:
+        for task in index.by_name(task_name):
+            if task.get('framework_id') == service['id']:
                 return task
 
     return None
@@ -172,12 +177,11 @@ def get_marathon_task(
 def get_mesos_task(task_name):
     """ Get a mesos task with a specific task name
     """
-    tasks = get_mesos_tasks()
+    index = get_task_index()
+    tasks = index.by_name(task_name)
 
-    if tasks is not None:
-        for task in tasks:
-            if task['name'] == task_name:
-                return task
+    if tasks:
+        return mesos.Task(tasks[0], mesos.Master(index.state))
     return None
 
 
@@ -459,6 +463,15 @@ def task_states_predicate(service_name, expected_task_count, expected_task_state
     return len(matching_tasks) >= expected_task_count
 
 
+def _task_event_wakeup(service_name):
+    """ Wakes a waiter on Marathon's task status updates, for the tasks
+        Marathon itself launches; other services' waiters poll.
+    """
+    if service_name == 'marathon':
+        return marathon_event_wakeup('status_update_event')
+    return None
+
+
 def wait_for_service_tasks_state(
         service_name,
         expected_task_count,
@@ -481,7 +494,8 @@ def wait_for_service_tasks_state(
     """
     return time_wait(
         lambda: task_states_predicate(service_name, expected_task_count, expected_task_states),
-        timeout_seconds=timeout_sec)
+        timeout_seconds=timeout_sec,
+        wakeup=_task_event_wakeup(service_name))
 
 
 def wait_for_service_tasks_running(
@@ -590,7 +604,8 @@ def wait_for_service_tasks_all_changed(
     """
     return time_wait(
         lambda: tasks_all_replaced_predicate(service_name, old_task_ids, task_predicate),
-        timeout_seconds=timeout_sec)
+        timeout_seconds=timeout_sec,
+        wakeup=_task_event_wakeup(service_name))
 
 
 def wait_for_service_tasks_all_unchanged(
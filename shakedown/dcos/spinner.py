@@ -1,10 +1,15 @@
-from dcos import util
+import asyncio
+import functools
+import inspect
+import random
+import reprlib
 import time as time_module
 import traceback
 
-import shakedown
+from dcos import util
 
-from inspect import currentframe, getargvalues, getsource, getouterframes
+import shakedown
+from shakedown.dcos.state import pinned_state
 
 logger = util.get_logger(__name__)
 
@@ -16,20 +21,30 @@ def wait_for(
         ignore_exceptions=True,
         inverse_predicate=False,
         noisy=False,
-        required_consecutive_success_count=1):
+        required_consecutive_success_count=1,
+        wakeup=None,
+        poll=None):
     """ waits or spins for a predicate, returning the result.
         Predicate is a function that returns a truthy or falsy value.
         An exception in the function will be returned.
         A timeout will throw a TimeoutExpired Exception.
+        A wakeup, such as an EventWakeup, ends the sleep between calls
+        early when an event arrives.
+        A poll strategy, such as ExponentialPoll, decides the sleep between
+        calls in place of sleep_seconds.  Sleeps never run past the timeout.
 
     """
     count = 0
     start_time = time_module.time()
     timeout = Deadline.create_deadline(timeout_seconds)
+    intervals = PollStrategy.create_poll(poll, sleep_seconds).intervals()
+    record = WaitRecord(predicate)
     while True:
+        record.polls += 1
         try:
-            result = predicate()
+            result = record.last_result = predicate()
         except Exception as e:
+            record.last_exception = e
             if ignore_exceptions:
                 if noisy:
                     logger.exception("Ignoring error during wait.")
@@ -43,8 +58,8 @@ def wait_for(
                 return result
 
         if timeout.is_expired():
-            funname = __stringify_predicate(predicate)
-            raise TimeoutExpired(timeout_seconds, funname)
+            record.elapsed = time_module.time() - start_time
+            raise TimeoutExpired(timeout_seconds, record)
         if noisy:
             header = '{}[{}/{}]'.format(
                 shakedown.cli.helpers.fchr('>>'),
@@ -57,23 +72,20 @@ def wait_for(
                     count,
                     required_consecutive_success_count)
             print('{} spinning...'.format(header))
-        time_module.sleep(sleep_seconds)
+        _sleep(next(intervals), timeout, wakeup)
 
 
-def __stringify_predicate(predicate):
-    """ Reflection of function name and parameters of the predicate being used.
+def _sleep(seconds, timeout, wakeup=None):
+    """ Sleep between calls to a predicate, no later than the deadline
     """
-    funname = getsource(predicate).strip().split(' ')[2].rstrip(',')
-    params = 'None'
-
-    # if args dig in the stack
-    if '()' not in funname:
-        stack = getouterframes(currentframe())
-        for frame in range(0, len(stack)):
-            if funname in str(stack[frame]):
-                _, _, _, params = getargvalues(stack[frame][0])
-
-    return "function: {} params: {}".format(funname, params)
+    remaining = timeout.remaining()
+    if wakeup is not None:
+        wakeup.wait(seconds, remaining)
+        return
+    if remaining is not None:
+        seconds = min(seconds, remaining)
+    if seconds > 0:
+        time_module.sleep(seconds)
 
 
 def time_wait(
@@ -83,14 +95,16 @@ def time_wait(
     ignore_exceptions=True,
     inverse_predicate=False,
     noisy=True,
-    required_consecutive_success_count=1):
+    required_consecutive_success_count=1,
+    wakeup=None,
+    poll=None):
     """ waits or spins for a predicate and returns the time of the wait.
         An exception in the function will be returned.
         A timeout will throw a TimeoutExpired Exception.
 
     """
     start = time_module.time()
-    wait_for(predicate, timeout_seconds, sleep_seconds, ignore_exceptions, inverse_predicate, noisy, required_consecutive_success_count)
+    wait_for(predicate, timeout_seconds, sleep_seconds, ignore_exceptions, inverse_predicate, noisy, required_consecutive_success_count, wakeup, poll)
     return elapse_time(start)
 
 
@@ -98,26 +112,32 @@ def wait_while_exceptions(
         predicate,
         timeout_seconds=120,
         sleep_seconds=1,
-        noisy=False):
+        noisy=False,
+        poll=None):
     """ waits for a predicate, ignoring exceptions, returning the result.
         Predicate is a function.
         Exceptions will trigger the sleep and retry; any non-exception result
         will be returned.
         A timeout will throw a TimeoutExpired Exception.
+        A poll strategy decides the sleep between calls, as for wait_for.
     """
     start_time = time_module.time()
     timeout = Deadline.create_deadline(timeout_seconds)
+    intervals = PollStrategy.create_poll(poll, sleep_seconds).intervals()
+    record = WaitRecord(predicate)
     while True:
+        record.polls += 1
         try:
             result = predicate()
             return result
         except Exception as e:
+            record.last_exception = e
             if noisy:
                 logger.exception("Ignoring error during wait.")
 
         if timeout.is_expired():
-            funname = __stringify_predicate(predicate)
-            raise TimeoutExpired(timeout_seconds, funname)
+            record.elapsed = time_module.time() - start_time
+            raise TimeoutExpired(timeout_seconds, record)
         if noisy:
             header = '{}[{}/{}]'.format(
                 shakedown.cli.helpers.fchr('>>'),
@@ -125,7 +145,166 @@ def wait_while_exceptions(
                 pretty_duration(timeout_seconds)
             )
             print('{} spinning...'.format(header))
-        time_module.sleep(sleep_seconds)
+        _sleep(next(intervals), timeout)
+
+
+async def async_wait_for(
+        predicate,
+        timeout_seconds=120,
+        sleep_seconds=1,
+        ignore_exceptions=True,
+        inverse_predicate=False,
+        noisy=False,
+        required_consecutive_success_count=1,
+        poll=None,
+        executor=None):
+    """ waits or spins for a predicate without blocking the event loop,
+        returning the result, as wait_for does.
+        Predicate is a function or a coroutine function.  Plain functions
+        are run in the loop's executor, or the given one, so that blocking
+        calls to the cluster don't hold up other waits.
+        A timeout will throw a TimeoutExpired Exception.
+
+    """
+    loop = asyncio.get_event_loop()
+    count = 0
+    start_time = time_module.time()
+    timeout = Deadline.create_deadline(timeout_seconds)
+    intervals = PollStrategy.create_poll(poll, sleep_seconds).intervals()
+    record = WaitRecord(predicate)
+    while True:
+        record.polls += 1
+        try:
+            if asyncio.iscoroutinefunction(predicate):
+                result = await predicate()
+            else:
+                result = await loop.run_in_executor(executor, predicate)
+                if inspect.isawaitable(result):
+                    result = await result
+            record.last_result = result
+        except Exception as e:
+            record.last_exception = e
+            if ignore_exceptions:
+                if noisy:
+                    logger.exception("Ignoring error during wait.")
+            else:
+                count = 0
+                raise  # preserve original stack
+        else:
+            if (not inverse_predicate and result) or (inverse_predicate and not result):
+                count = count + 1
+            if count >= required_consecutive_success_count:
+                return result
+
+        if timeout.is_expired():
+            record.elapsed = time_module.time() - start_time
+            raise TimeoutExpired(timeout_seconds, record)
+        if noisy:
+            print('{}[{}/{}] spinning...'.format(
+                shakedown.cli.helpers.fchr('>>'),
+                pretty_duration(time_module.time() - start_time),
+                pretty_duration(timeout_seconds)))
+        seconds = next(intervals)
+        remaining = timeout.remaining()
+        if remaining is not None:
+            seconds = min(seconds, remaining)
+        await asyncio.sleep(seconds)
+
+
+async def async_time_wait(
+        predicate,
+        timeout_seconds=120,
+        sleep_seconds=1,
+        ignore_exceptions=True,
+        inverse_predicate=False,
+        noisy=True,
+        required_consecutive_success_count=1,
+        poll=None,
+        executor=None):
+    """ waits or spins for a predicate without blocking the event loop, and
+        returns the time of the wait, as time_wait does.
+
+    """
+    start = time_module.time()
+    await async_wait_for(predicate, timeout_seconds, sleep_seconds, ignore_exceptions, inverse_predicate, noisy,
+                         required_consecutive_success_count, poll, executor)
+    return elapse_time(start)
+
+
+def wait_for_all(
+        predicates,
+        timeout_seconds=120,
+        sleep_seconds=1,
+        ignore_exceptions=True,
+        noisy=False,
+        poll=None,
+        wakeup=None):
+    """ waits for every one of many predicates, checking them all in one
+        loop.  Each tick checks the predicates which haven't yet passed
+        against one shared snapshot of the cluster state, so the wait takes
+        as long as the slowest predicate rather than the sum of them.
+        Predicates is a dict of name to predicate, or a list of predicates
+        named by their index.
+        Returns a dict of each name to the seconds it took to pass.
+        A timeout will throw a TimeoutExpired Exception naming those still pending.
+
+    """
+    return _wait_for_predicates(predicates, True, timeout_seconds, sleep_seconds, ignore_exceptions, noisy, poll, wakeup)
+
+
+def wait_for_any(
+        predicates,
+        timeout_seconds=120,
+        sleep_seconds=1,
+        ignore_exceptions=True,
+        noisy=False,
+        poll=None,
+        wakeup=None):
+    """ waits for at least one of many predicates, as wait_for_all does.
+        Returns a dict of the name of each predicate which passed in the
+        first tick any did to the seconds it took.
+
+    """
+    return _wait_for_predicates(predicates, False, timeout_seconds, sleep_seconds, ignore_exceptions, noisy, poll, wakeup)
+
+
+def _wait_for_predicates(predicates, wait_all, timeout_seconds, sleep_seconds, ignore_exceptions, noisy, poll, wakeup):
+    if not isinstance(predicates, dict):
+        predicates = dict(enumerate(predicates))
+    pending = dict(predicates)
+    passed = {}
+    start_time = time_module.time()
+    timeout = Deadline.create_deadline(timeout_seconds)
+    intervals = PollStrategy.create_poll(poll, sleep_seconds).intervals()
+    while True:
+        with pinned_state():
+            for name, predicate in list(pending.items()):
+                try:
+                    result = predicate()
+                except Exception:
+                    if not ignore_exceptions:
+                        raise  # preserve original stack
+                    if noisy:
+                        logger.exception("Ignoring error during wait.")
+                else:
+                    if result:
+                        passed[name] = elapse_time(start_time)
+                        del pending[name]
+
+        if not pending or (passed and not wait_all):
+            return passed
+
+        if timeout.is_expired():
+            raise TimeoutExpired(timeout_seconds, '{} of {} predicates: {}'.format(
+                'all' if wait_all else 'any', len(predicates), ', '.join(str(name) for name in pending)))
+        if noisy:
+            print('{}[{}/{}] {} of {} passed, spinning...'.format(
+                shakedown.cli.helpers.fchr('>>'),
+                pretty_duration(time_module.time() - start_time),
+                pretty_duration(timeout_seconds),
+                len(passed),
+                len(predicates)))
+        _sleep(next(intervals), timeout, wakeup)
 
 
 def elapse_time(start, end=None, precision=3):
@@ -162,6 +341,10 @@ class Deadline(object):
     def is_expired(self):
         raise NotImplementedError()
 
+    def remaining(self):
+        """ Seconds left before the deadline, or None if there is none """
+        raise NotImplementedError()
+
     @staticmethod
     def create_deadline(seconds):
         if seconds is None:
@@ -178,19 +361,174 @@ class Within(Deadline):
     def is_expired(self):
         return time_module.time() >= self._deadline
 
+    def remaining(self):
+        return max(0, self._deadline - time_module.time())
+
 
 class Forever(Deadline):
 
     def is_expired(self):
         return False
 
+    def remaining(self):
+        return None
+
+
+class PollStrategy(object):
+    """ Decides how long a waiter sleeps between calls to its predicate.
+    """
+
+    def intervals(self):
+        """ A generator of the seconds to sleep after each call, started
+            afresh for each wait
+        """
+        raise NotImplementedError()
+
+    @staticmethod
+    def create_poll(poll, sleep_seconds):
+        if poll is None:
+            return FixedPoll(sleep_seconds)
+        return poll
+
+
+class FixedPoll(PollStrategy):
+    """ Sleeps the same time after every call
+    """
+
+    def __init__(self, seconds=1):
+        super(FixedPoll, self).__init__()
+        self.seconds = seconds
+
+    def intervals(self):
+        while True:
+            yield self.seconds
+
+
+class ExponentialPoll(PollStrategy):
+    """ Sleeps initial seconds after the first call, multiplying the sleep by
+        factor after each call up to maximum seconds
+    """
+
+    def __init__(self, initial=0.25, factor=2, maximum=10):
+        super(ExponentialPoll, self).__init__()
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def intervals(self):
+        seconds = self.initial
+        while True:
+            yield min(seconds, self.maximum)
+            seconds *= self.factor
+
+
+class JitteredPoll(PollStrategy):
+    """ Spreads the sleeps of another strategy randomly by up to jitter of
+        each sleep either way, so that many waiters don't poll in lockstep
+    """
+
+    def __init__(self, poll=None, jitter=0.5):
+        super(JitteredPoll, self).__init__()
+        self.poll = poll or FixedPoll()
+        self.jitter = jitter
+
+    def intervals(self):
+        for seconds in self.poll.intervals():
+            yield random.uniform(seconds * (1 - self.jitter), seconds * (1 + self.jitter))
+
+
+class FastStartPoll(PollStrategy):
+    """ Sleeps fast_seconds between calls for the first fast_period seconds of
+        the wait, when quick predicates are likely to pass, then seconds
+    """
+
+    def __init__(self, fast_seconds=0.1, fast_period=2, seconds=1):
+        super(FastStartPoll, self).__init__()
+        self.fast_seconds = fast_seconds
+        self.fast_period = fast_period
+        self.seconds = seconds
+
+    def intervals(self):
+        start = time_module.time()
+        while time_module.time() - start < self.fast_period:
+            yield self.fast_seconds
+        while True:
+            yield self.seconds
+
+
+class WaitRecord(object):
+    """ What a wait saw of its predicate: the number of calls, the last
+        result and the last exception, and the seconds it waited.  It is
+        only described, which is comparatively slow, when rendered.
+    """
+
+    def __init__(self, predicate):
+        self.predicate = predicate
+        self.polls = 0
+        self.last_result = None
+        self.last_exception = None
+        self.elapsed = None
+
+    @property
+    def name(self):
+        """ The predicate's qualified name """
+        predicate = self.predicate
+        if isinstance(predicate, functools.partial):
+            predicate = predicate.func
+        return getattr(predicate, '__qualname__', None) or repr(predicate)
+
+    @property
+    def arguments(self):
+        """ The values bound into the predicate: a partial's arguments, or
+            the variables a lambda or nested function closes over
+        """
+        predicate = self.predicate
+        if isinstance(predicate, functools.partial):
+            arguments = dict(enumerate(predicate.args))
+            arguments.update(predicate.keywords or {})
+            return arguments
+        if hasattr(predicate, '__self__'):
+            return {'self': predicate.__self__}
+
+        code = getattr(predicate, '__code__', None)
+        closure = getattr(predicate, '__closure__', None) or ()
+        if code is None:
+            return {}
+        arguments = {}
+        for name, cell in zip(code.co_freevars, closure):
+            try:
+                arguments[name] = cell.cell_contents
+            except ValueError:
+                # an empty cell
+                pass
+        return arguments
+
+    def __str__(self):
+        arguments = ', '.join('{}={}'.format(k, reprlib.repr(v)) for k, v in sorted(self.arguments.items(), key=str))
+        description = 'function: {} params: {{{}}} after {} call{}'.format(
+            self.name, arguments, self.polls, '' if self.polls == 1 else 's')
+        if self.elapsed is not None:
+            description += ' in {}'.format(pretty_duration(self.elapsed))
+        description += ', last result: {}'.format(reprlib.repr(self.last_result))
+        if self.last_exception is not None:
+            description += ', last exception: {}'.format(reprlib.repr(self.last_exception))
+        return description
+
 
 class TimeoutExpired(Exception):
+    """ Raised when a wait times out.  `record` is the wait's WaitRecord,
+        if it waited on a single predicate.
+    """
+
     def __init__(self, timeout_seconds, what):
         super(TimeoutExpired, self).__init__(timeout_seconds, what)
         self._timeout_seconds = timeout_seconds
         self._what = what
 
+    @property
+    def record(self):
+        return self._what if isinstance(self._what, WaitRecord) else None
+
     def __str__(self):
         return "Timeout of {0} expired waiting for {1}".format(pretty_duration(self._timeout_seconds), self._what)
 
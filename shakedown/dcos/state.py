@@ -0,0 +1,298 @@
+""" Short-lived snapshots of the Mesos master state.
+
+    Many helpers need the master's `/state` or `/state-summary`, and a single
+    tick of a waiter often calls several of them.  They share one fetch
+    through the caches here; the snapshots are kept for less than a tick, so
+    each tick still sees current state.  Within `pinned_state()` every caller
+    shares one snapshot however long the tick takes.  Treat the returned state
+    as read-only.
+"""
+import contextlib
+import fnmatch
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from threading import RLock
+
+from dcos import mesos
+
+
+# seconds a snapshot is shared for; less than the one second between spinner ticks
+STATE_CACHE_TTL = 0.5
+
+COMPLETED_TASK_STATES = frozenset(mesos.COMPLETED_TASK_STATES)
+
+
+class SnapshotCache:
+    """ Holds the result of `fetch` for `ttl` seconds.  Callers arriving
+        while a fetch is in progress wait for it rather than starting another.
+    """
+
+    def __init__(self, fetch, ttl=STATE_CACHE_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.fetches = 0
+        self._value = None
+        self._fetched_at = None
+        self._lock = RLock()
+        # each thread's pin: its depth, when it began, and the snapshot it holds
+        self._pins = threading.local()
+
+    def get(self, fresh=False):
+        """ The current snapshot, fetching a new one if it is older than the
+            TTL or `fresh` is True.  Within this thread's pin, the first
+            snapshot fetched since the pin began is kept unless `fresh` is True.
+        """
+        pins = self._pins
+        pinned = getattr(pins, 'depth', 0) > 0
+        if pinned and not fresh and pins.value is not None:
+            return pins.value
+
+        with self._lock:
+            if fresh or self._stale(pins.started_at if pinned else None):
+                self._value = self.fetch()
+                self._fetched_at = time.time()
+                self.fetches += 1
+            value = self._value
+
+        if pinned:
+            pins.value = value
+        return value
+
+    def _stale(self, pinned_at):
+        if self._fetched_at is None:
+            return True
+        if pinned_at is not None:
+            return self._fetched_at < pinned_at
+        return time.time() - self._fetched_at >= self.ttl
+
+    @contextlib.contextmanager
+    def pin(self):
+        """ Share one snapshot, fetched at most once, between the calls this
+            thread makes for the duration of the block; nested pins share the
+            outer one.  Other threads are unaffected.
+        """
+        pins = self._pins
+        if getattr(pins, 'depth', 0) == 0:
+            pins.started_at = time.time()
+            pins.value = None
+        pins.depth = getattr(pins, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            pins.depth -= 1
+            if pins.depth == 0:
+                pins.value = None
+
+    def invalidate(self):
+        """ Drop the snapshot, so that the next `get` fetches a new one.
+        """
+        with self._lock:
+            self._value = None
+            self._fetched_at = None
+        self._pins.value = None
+
+
+_master_state = SnapshotCache(lambda: mesos.DCOSClient().get_master_state())
+_state_summary = SnapshotCache(lambda: mesos.DCOSClient().get_state_summary())
+
+
+# a source of the master state kept current by events, used instead of
+# fetching `/state` while it is connected; see shakedown.dcos.events
+_live_state = None
+
+
+def set_live_state(source):
+    """ Read the master state from source, an object with a `connected`
+        property and a `state()` method, whenever it is connected; None
+        returns to fetching it.
+    """
+    global _live_state
+    _live_state = source
+
+
+def get_master_state(fresh=False):
+    """ The Mesos master's `/state`, shared with other callers for up to
+        `STATE_CACHE_TTL` seconds, or taken from the live event-driven model
+        while one is connected
+
+        :param fresh: fetch a new snapshot rather than sharing a recent one
+        :type fresh: bool
+
+        :return: the master state
+        :rtype: dict
+    """
+    live = _live_state
+    if live is not None and live.connected:
+        return live.state()
+    return _master_state.get(fresh)
+
+
+def get_state_summary(fresh=False):
+    """ The Mesos master's `/state-summary`, shared with other callers for up
+        to `STATE_CACHE_TTL` seconds
+
+        :param fresh: fetch a new snapshot rather than sharing a recent one
+        :type fresh: bool
+
+        :return: the master state summary
+        :rtype: dict
+    """
+    return _state_summary.get(fresh)
+
+
+@contextlib.contextmanager
+def pinned_state():
+    """ Share one fetch of the master state and of the state summary between
+        every helper this thread calls within the block, such as the
+        predicates checked in one tick of `wait_for_all()`.
+    """
+    with _master_state.pin(), _state_summary.pin():
+        yield
+
+
+def invalidate_state_cache():
+    """ Drop the shared master state snapshots, for example right after
+        changing the cluster.
+    """
+    _master_state.invalidate()
+    _state_summary.invalidate()
+
+
+class TaskIndex:
+    """ The tasks of one master state snapshot, indexed by id, name,
+        framework, agent and state.  Lookups take the same `completed` flag as
+        `dcos.mesos.Master.tasks`: False for the tasks the master is currently
+        running, True for completed tasks only, and return task dicts in the
+        order `Master.tasks` would.
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self._tasks = []
+        self._running = set()
+        self._by_id = defaultdict(list)
+        self._by_name = defaultdict(list)
+        self._by_framework = defaultdict(list)
+        self._by_agent = defaultdict(list)
+        self._by_state = defaultdict(list)
+
+        for framework in self._frameworks(inactive=True, completed=True):
+            for key in ('tasks', 'completed_tasks'):
+                for task in framework.get(key, []):
+                    self._tasks.append(task)
+                    if key == 'tasks':
+                        self._running.add(id(task))
+                    self._by_id[task['id']].append(task)
+                    self._by_name[task.get('name')].append(task)
+                    self._by_framework[framework['id']].append(task)
+                    self._by_agent[task.get('slave_id')].append(task)
+                    self._by_state[task.get('state')].append(task)
+
+        self._sorted_ids = None
+
+    def tasks(self, completed=False):
+        """ All tasks """
+        return self._select(self._tasks, completed)
+
+    def by_id(self, task_id, completed=False):
+        """ Tasks with exactly this id """
+        return self._select(self._by_id.get(task_id, []), completed)
+
+    def by_prefix(self, prefix, completed=False):
+        """ Tasks whose id starts with prefix, ordered by id """
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(self._by_id)
+
+        ids = self._sorted_ids
+        tasks = []
+        for i in range(bisect_left(ids, prefix), len(ids)):
+            if not ids[i].startswith(prefix):
+                break
+            tasks.extend(self._by_id[ids[i]])
+        return self._select(tasks, completed)
+
+    def by_name(self, name, completed=False):
+        """ Tasks with this name """
+        return self._select(self._by_name.get(name, []), completed)
+
+    def by_framework(self, framework_id, completed=False):
+        """ Tasks of the framework with this id """
+        return self._select(self._by_framework.get(framework_id, []), completed)
+
+    def by_agent(self, agent_id, completed=False):
+        """ Tasks on the agent with this id """
+        return self._select(self._by_agent.get(agent_id, []), completed)
+
+    def by_state(self, state):
+        """ Tasks in this state, such as 'TASK_RUNNING' """
+        return list(self._by_state.get(state, []))
+
+    def matching(self, fltr, completed=False):
+        """ Tasks whose id contains fltr or matches it as a glob, like
+            `Master.tasks(fltr=fltr)`; all tasks if fltr is empty
+        """
+        if not fltr:
+            return self.tasks(completed)
+        if any(c in fltr for c in '*?['):
+            glob = re.compile(fnmatch.translate(fltr)).match
+            ids = set(i for i in self._by_id if fltr in i or glob(i))
+        else:
+            ids = set(i for i in self._by_id if fltr in i)
+        return [task for task in self.tasks(completed) if task['id'] in ids]
+
+    def lookup(self, task_id, completed=False):
+        """ Tasks with exactly this id if there are any, otherwise the
+            tasks `matching` it
+        """
+        if task_id in self._by_id:
+            return self.by_id(task_id, completed)
+        return self.matching(task_id, completed)
+
+    def framework(self, name, inactive=False, completed=False):
+        """ The first framework with this name, like `Master.frameworks`
+
+            :return: the framework's dict, or None
+            :rtype: dict
+        """
+        for framework in self._frameworks(inactive, completed):
+            if framework['name'] == name:
+                return framework
+        return None
+
+    def _frameworks(self, inactive, completed):
+        if completed:
+            yield from self.state.get('completed_frameworks', [])
+        for framework in self.state.get('frameworks', []):
+            if framework['active'] or inactive:
+                yield framework
+
+    def _select(self, tasks, completed):
+        if completed:
+            return [task for task in tasks if task.get('state') in COMPLETED_TASK_STATES]
+        return [task for task in tasks if id(task) in self._running]
+
+
+_task_index = None
+_task_index_lock = RLock()
+
+
+def get_task_index(fresh=False):
+    """ A `TaskIndex` of the shared master state snapshot, built once per
+        snapshot
+
+        :param fresh: fetch a new snapshot rather than sharing a recent one
+        :type fresh: bool
+
+        :return: the task index
+        :rtype: TaskIndex
+    """
+    global _task_index
+
+    state = get_master_state(fresh)
+    with _task_index_lock:
+        if _task_index is None or _task_index.state is not state:
+            _task_index = TaskIndex(state)
+        return _task_index
@@ -1,12 +1,12 @@
-from dcos import mesos
+import time
 
+import shakedown
+from shakedown.dcos import *
 from shakedown.dcos.helpers import *
 from shakedown.dcos.service import *
+from shakedown.dcos.service import _task_event_wakeup
 from shakedown.dcos.spinner import *
-from shakedown.dcos import *
-
-import shakedown
-import time
+from shakedown.dcos.state import get_task_index
 
 
 def get_tasks(task_id='', completed=True):
@@ -23,14 +23,12 @@ def get_tasks(task_id='', completed=True):
         :rtype: []
     """
 
-    client = mesos.DCOSClient()
-    master = mesos.Master(client.get_master_state())
-    mesos_tasks = master.tasks(completed=completed, fltr=task_id)
-    return [task.__dict__['_task'] for task in mesos_tasks]
+    return get_task_index().matching(task_id, completed)
 
 
 def get_task(task_id, completed=True):
-    """ Get a task by task id where a task_id is required.
+    """ Get a task by task id where a task_id is required.  A task with
+        exactly this id is preferred over ones whose id merely contains it.
 
         :param task_id: task ID
         :type task_id: str
@@ -40,7 +38,7 @@ def get_task(task_id, completed=True):
         :return: a task
         :rtype: obj
     """
-    tasks = get_tasks(task_id=task_id, completed=completed)
+    tasks = get_task_index().lookup(task_id, completed)
 
     if len(tasks) == 0:
         return None
@@ -66,14 +64,13 @@ def task_completed(task_id):
         :rtype: bool
     """
 
-    tasks = get_tasks(task_id=task_id)
     completed_states = ('TASK_FINISHED',
                         'TASK_FAILED',
                         'TASK_KILLED',
                         'TASK_LOST',
                         'TASK_ERROR')
 
-    for task in tasks:
+    for task in get_task_index().lookup(task_id, completed=True):
         if task['state'] in completed_states:
             return True
 
@@ -117,7 +114,9 @@ def task_property_present_predicate(service, task, prop):
 
 def wait_for_task(service, task, timeout_sec=120):
     """Waits for a task which was launched to be launched"""
-    return time_wait(lambda: task_predicate(service, task), timeout_seconds=timeout_sec)
+    return time_wait(lambda: task_predicate(service, task),
+                     timeout_seconds=timeout_sec,
+                     wakeup=_task_event_wakeup(service))
 
 
 def wait_for_task_property(service, task, prop, timeout_sec=120):
@@ -0,0 +1,159 @@
+""" Micro-benchmark of the per-command overhead of HostSession output collection.
+
+    Runs commands against a simulated channel with a fixed round-trip time and
+    compares the previous collection strategy (200ms sleep polling and 1024 byte
+    reads) against the current one.
+
+        python tests/benchmark/bench_hostsession.py [--rtt 0.005] [--runs 20]
+"""
+import argparse
+import socket
+import statistics
+import threading
+import time
+from select import select
+
+from shakedown.dcos import command
+
+
+class SimulatedChannel:
+    """Emulates a paramiko channel: output arrives in packets after one
+    round trip, followed by EOF and the exit status."""
+
+    def __init__(self, output, rtt, packet_size=32768):
+        self.packets = [output[i:i + packet_size] for i in range(0, len(output), packet_size)]
+        self.rtt = rtt
+        self.buffer = bytearray()
+        self.eof = False
+        self.closed = False
+        self.timeout = None
+        self.status_event = threading.Event()
+        self.cond = threading.Condition()
+        self.rfd, self.wfd = socket.socketpair()
+
+    def exec_command(self, command):
+        threading.Thread(target=self._deliver).start()
+
+    def _deliver(self):
+        time.sleep(self.rtt)
+        for packet in self.packets:
+            with self.cond:
+                self.buffer.extend(packet)
+                self.cond.notify_all()
+            self.wfd.send(b'.')
+        with self.cond:
+            self.eof = True
+            self.cond.notify_all()
+        self.status_event.set()
+
+    def fileno(self):
+        return self.rfd.fileno()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recv_ready(self):
+        with self.cond:
+            return len(self.buffer) > 0
+
+    def recv(self, nbytes):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.buffer or self.eof, self.timeout):
+                raise socket.timeout()
+            data = bytes(self.buffer[:nbytes])
+            del self.buffer[:nbytes]
+            return data
+
+    def recv_exit_status(self):
+        self.status_event.wait()
+        return 0
+
+    def close(self):
+        self.closed = True
+        self.rfd.close()
+        self.wfd.close()
+
+
+def legacy_collect(session):
+    """The collection loop HostSession used before output was event-driven."""
+    session.recv_exit_status()
+    while True:
+        time.sleep(0.2)
+        if session.recv_ready() or session.closed:
+            break
+    output = ''
+    while session.recv_ready():
+        rl, wl, xl = select([session], [], [], 0.0)
+        if len(rl) > 0:
+            output += str(session.recv(1024), 'utf-8')
+    session.close()
+    return output
+
+
+class SimulatedConnection:
+    """Emulates a cached paramiko transport that hands out the channel of
+    the current run."""
+
+    channel = None
+
+    def open_session(self):
+        return self.channel
+
+    def is_active(self):
+        return True
+
+    def is_authenticated(self):
+        return True
+
+
+connection = SimulatedConnection()
+
+
+@command.connection_cache
+def simulated_get_connection(host, username, key_path):
+    return connection
+
+
+def current_collect(session):
+    connection.channel = session
+    with command.HostSession('bench', None, None, False) as hs:
+        hs.run('bench')
+    return hs.output
+
+
+def measure(collect, output, rtt, runs):
+    timings = []
+    for _ in range(runs):
+        session = SimulatedChannel(output, rtt)
+        start = time.time()
+        if collect is legacy_collect:
+            session.exec_command('bench')
+        result = collect(session)
+        timings.append(time.time() - start)
+        assert len(result) == len(output)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rtt', type=float, default=0.005, help='simulated round-trip time in seconds')
+    parser.add_argument('--runs', type=int, default=20, help='runs per measurement')
+    args = parser.parse_args()
+
+    cases = [
+        ('echo', b'hello\n'),
+        ('1MB output', b'x' * (1024 * 1024)),
+    ]
+
+    # sessions are opened through the connection cache, as they are on a cluster
+    command._get_connection = simulated_get_connection
+
+    print('{:<12} {:>12} {:>12}'.format('command', 'before', 'after'))
+    for name, output in cases:
+        before = measure(legacy_collect, output, args.rtt, args.runs)
+        after = measure(current_collect, output, args.rtt, args.runs)
+        print('{:<12} {:>10.1f}ms {:>10.1f}ms'.format(name, before * 1000, after * 1000))
+
+
+if __name__ == '__main__':
+    main()
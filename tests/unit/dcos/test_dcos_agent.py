@@ -0,0 +1,16 @@
+from shakedown.dcos import agent
+
+
+def test_get_public_agents_public_ip(monkeypatch, capsys):
+    """Test that agents whose IP couldn't be detected are left out."""
+    def mock_run_command_on_hosts(hosts, command, *args, **kwargs):
+        return {
+            '10.0.4.1': (True, '52.0.0.1\n', 0.1),
+            '10.0.4.2': (False, 'connection refused', 0.1),
+        }
+
+    monkeypatch.setattr(agent, 'get_public_agents', lambda: ['10.0.4.1', '10.0.4.2'])
+    monkeypatch.setattr(agent.shakedown, 'run_command_on_hosts', mock_run_command_on_hosts)
+
+    assert agent.get_public_agents_public_ip() == ['52.0.0.1\n']
+    assert 'error: unable to detect the public IP of agent 10.0.4.2: connection refused' in capsys.readouterr().out
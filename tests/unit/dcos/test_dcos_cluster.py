@@ -0,0 +1,66 @@
+import importlib
+
+import shakedown
+
+# the package, rather than the dcos library module it re-exports as shakedown.dcos
+shakedown_dcos = importlib.import_module('shakedown.dcos')
+
+
+class MockConfig:
+    reads = 0
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_config_path(self):
+        return self.path
+
+    def get_config(self):
+        MockConfig.reads += 1
+        with open(self.path) as f:
+            return {'core.dcos_url': f.read()}
+
+
+def test_dcos_url_follows_config_file(monkeypatch, tmpdir):
+    config = tmpdir.join('dcos.toml')
+    config.write('https://cluster-a')
+    monkeypatch.setattr(shakedown_dcos.dcos, 'config', MockConfig(str(config)))
+    shakedown.invalidate_cluster_metadata()
+    MockConfig.reads = 0
+
+    assert shakedown.dcos_url() == 'https://cluster-a'
+    assert shakedown.dcos_url() == 'https://cluster-a'
+    assert MockConfig.reads == 1
+
+    config.write('https://cluster-bb')
+    assert shakedown.dcos_url() == 'https://cluster-bb'
+    assert MockConfig.reads == 2
+
+    shakedown.invalidate_cluster_metadata()
+
+
+def test_cluster_metadata(monkeypatch):
+    url = ['https://cluster-a']
+    monkeypatch.setattr(shakedown_dcos, 'dcos_url', lambda: url[0])
+    shakedown.invalidate_cluster_metadata()
+    fetches = []
+
+    def fetch():
+        fetches.append(url[0])
+        return None if len(fetches) == 1 else '1.10.0'
+
+    # None is retried, found values are kept per cluster
+    assert shakedown.cluster_metadata('dcos_version', fetch) is None
+    assert shakedown.cluster_metadata('dcos_version', fetch) == '1.10.0'
+    assert shakedown.cluster_metadata('dcos_version', fetch) == '1.10.0'
+    assert len(fetches) == 2
+
+    url[0] = 'https://cluster-b'
+    shakedown.cluster_metadata('dcos_version', fetch)
+    assert fetches[-1] == 'https://cluster-b'
+
+    shakedown.invalidate_cluster_metadata()
+    shakedown.cluster_metadata('dcos_version', fetch)
+    assert len(fetches) == 4
+
+    shakedown.invalidate_cluster_metadata()
@@ -1,3 +1,13 @@
+import asyncio
+import socket
+import subprocess
+import sys
+import threading
+import time
+import types
+
+import pytest
+
 from shakedown import connection_cache
 from shakedown.dcos import command
 
@@ -23,6 +33,64 @@ class MockConnection:
         return not self.failure
 
 
+class MockChannel:
+    """Emulates the blocking read semantics of a paramiko channel; output
+    is delivered from another thread after `delay` seconds."""
+
+    def __init__(self, chunks, exit_status=0, delay=0.0):
+        self.chunks = list(chunks)
+        self.exit_status = exit_status
+        self.delay = delay
+        self.buffer = []
+        self.eof = False
+        self.closed = False
+        self.timeout = None
+        self.status_event = threading.Event()
+        self.cond = threading.Condition()
+
+    def exec_command(self, command):
+        threading.Thread(target=self._deliver).start()
+
+    def _deliver(self):
+        time.sleep(self.delay)
+        with self.cond:
+            self.buffer.extend(self.chunks)
+            self.eof = True
+            self.cond.notify_all()
+        self.status_event.set()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def set_combine_stderr(self, combine):
+        self.combine_stderr = combine
+
+    def recv(self, nbytes):
+        with self.cond:
+            if not self.cond.wait_for(lambda: self.buffer or self.eof, self.timeout):
+                raise socket.timeout()
+            return self.buffer.pop(0) if self.buffer else b''
+
+    def recv_exit_status(self):
+        self.status_event.wait()
+        return self.exit_status
+
+    def close(self):
+        self.closed = True
+
+
+class MockSessionConnection:
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def open_session(self):
+        return self.channel
+
+    def is_active(self):
+        return True
+
+
 def test_hostsession_enter(monkeypatch):
     """Test that `get_session` calls `_get_connection` for a 
     connection and then opens a new session.
@@ -30,7 +98,7 @@ def test_hostsession_enter(monkeypatch):
     def mockreturn(h, u, k):
         return MockConnection(h, u, k)
     # replace _get_connection with mockreturn
-    monkeypatch.setattr(command, '_get_connection', mockreturn)
+    monkeypatch.setattr(command, '_get_connection', connection_cache(mockreturn))
 
     hs = command.HostSession('local', 'me', 'key', True)
     v = hs.__enter__()
@@ -46,7 +114,7 @@ def test_hostsession_enter_fail(monkeypatch):
     def mockreturn(h, u, k):
         return MockConnection(h, u, k, True)
     # replace _get_connection with mockreturn
-    monkeypatch.setattr(command, '_get_connection', mockreturn)
+    monkeypatch.setattr(command, '_get_connection', connection_cache(mockreturn))
 
     hs = command.HostSession('local', 'me', 'key', True)
     v = hs.__enter__()
@@ -115,3 +183,353 @@ def test_connection_cache_none():
     assert 'local-me' in f.get_cache()
     f('local2', 'me', 'key')
     assert len(f.get_cache()) == 2
+
+
+def test_run_command_on_hosts(monkeypatch):
+    """Test that commands run concurrently and every host gets a result."""
+    def mockreturn(host, command, *args):
+        time.sleep(0.2)
+        if host == 'bad':
+            raise ValueError('unable to connect')
+        return True, '{}: {}'.format(host, command)
+    monkeypatch.setattr(command, 'run_command', mockreturn)
+    cached = connection_cache(lambda h, u, k: MockConnection(h, u, k), max_size=1)
+    monkeypatch.setattr(command, '_get_connection', cached)
+
+    start = time.time()
+    results = command.run_command_on_hosts(['a', 'b', 'bad', 'a'], 'uptime')
+    assert time.time() - start < 0.4
+    # the connections in use are leased, so the cache bound is left alone
+    assert cached.settings()['max_size'] == 1
+
+    assert list(results) == ['a', 'b', 'bad']
+    assert results['a'][:2] == (True, 'a: uptime')
+    assert results['b'][:2] == (True, 'b: uptime')
+    assert results['bad'][:2] == (False, 'unable to connect')
+    assert results['a'][2] >= 0.2
+
+
+def test_hostsession_output(monkeypatch):
+    """Test that output is collected without a polling delay and that
+    multi-byte characters split across reads are decoded."""
+    channel = MockChannel([b'caf', '\u00e9'.encode()[:1], '\u00e9'.encode()[1:], b'\n'], 3)
+    monkeypatch.setattr(command, '_get_connection', connection_cache(lambda h, u, k: MockSessionConnection(channel)))
+
+    start = time.time()
+    with command.HostSession('local', 'me', 'key', False) as s:
+        s.run('echo')
+    assert time.time() - start < 0.1
+    assert s.get_result() == (3, 'caf\u00e9\n')
+    assert channel.closed
+
+
+def test_hostsession_timeout(monkeypatch):
+    """Test that a command which doesn't complete in time is abandoned."""
+    channel = MockChannel([b'late'], delay=1.0)
+    monkeypatch.setattr(command, '_get_connection', connection_cache(lambda h, u, k: MockSessionConnection(channel)))
+
+    start = time.time()
+    with command.HostSession('local', 'me', 'key', False, timeout=0.2) as s:
+        s.run('sleep 1')
+    assert time.time() - start < 0.5
+    exit_code, output = s.get_result()
+    assert exit_code == -1
+    assert 'timed out' in output
+    assert channel.closed
+
+
+def test_stream_command(monkeypatch):
+    """Test that output is split into lines across reads and that the
+    exit code is available once the stream is exhausted."""
+    channel = MockChannel([b'one\ntw', b'o\n', b'three'], 2)
+    monkeypatch.setattr(command, '_get_connection', connection_cache(lambda h, u, k: MockSessionConnection(channel)))
+
+    stream = command.stream_command('local', 'journalctl -f', noisy=False)
+    assert list(stream) == ['one', 'two', 'three']
+    assert stream.exit_code == 2
+    assert channel.combine_stderr
+    assert channel.closed
+
+
+def test_stream_command_break(monkeypatch):
+    """Test that leaving the loop early closes the session."""
+    channel = MockChannel([b'ready\n', b'more\n'], delay=0.0)
+    monkeypatch.setattr(command, '_get_connection', connection_cache(lambda h, u, k: MockSessionConnection(channel)))
+
+    stream = command.stream_command('local', 'journalctl -f', noisy=False)
+    lines = iter(stream)
+    assert next(lines) == 'ready'
+    lines.close()
+    assert channel.closed
+    assert stream.exit_code is None
+
+
+def test_stream_command_unreachable(monkeypatch):
+    monkeypatch.setattr(command, '_get_connection', connection_cache(lambda h, u, k: None))
+
+    with pytest.raises(ConnectionError) as e:
+        list(command.stream_command('down', 'journalctl -f', noisy=False))
+    assert 'down' in str(e.value)
+
+
+def test_run_command_unreachable(monkeypatch):
+    monkeypatch.setattr(command, '_get_connection', connection_cache(lambda h, u, k: None))
+
+    assert command.run_command('down', 'uptime', noisy=False) == (False, 'unable to connect to down')
+    results = command.run_command_on_hosts(['down'], 'uptime', noisy=False)
+    assert results['down'][:2] == (False, 'unable to connect to down')
+
+    with pytest.raises(ConnectionError):
+        with command.HostSession('down', None, None, False) as s:
+            s.run('uptime')
+
+
+def test_connection_cache_eviction(monkeypatch):
+    """Test LRU and idle eviction, keepalives and the statistics."""
+    now = [1000.0]
+    monkeypatch.setattr(command, 'time', types.SimpleNamespace(time=lambda: now[0]))
+
+    keepalives = []
+
+    class KeepaliveConnection(MockConnection):
+        closed = False
+
+        def set_keepalive(self, interval):
+            keepalives.append(interval)
+
+        def close(self):
+            self.closed = True
+
+    @connection_cache(max_size=2, idle_ttl=60, keepalive=15)
+    def f(host, user, key_path):
+        """generic func to emulate _get_connection"""
+        return KeepaliveConnection(host, user, key_path)
+
+    a = f('a', 'me', 'key')
+    f('b', 'me', 'key')
+    assert f('a', 'me', 'key') is a
+    assert keepalives == [15, 15]
+
+    # 'b' is the least recently used
+    f('c', 'me', 'key')
+    assert list(f.get_cache()) == ['a-me', 'c-me']
+
+    # a reconnect replaces a failed connection
+    a.failure = True
+    assert f('a', 'me', 'key') is not a
+    assert a.closed
+
+    # everything idle for longer than the ttl is closed
+    now[0] += 61
+    f('d', 'me', 'key')
+    assert list(f.get_cache()) == ['d-me']
+
+    assert f.stats() == {'hits': 1, 'misses': 4, 'reconnects': 1, 'evictions': 3, 'size': 1}
+
+    f.configure(max_size=None)
+    for host in 'efgh':
+        f(host, 'me', 'key')
+    assert len(f.get_cache()) == 5
+
+
+def test_connection_cache_leases():
+    """Test that leased connections, and the one being handed out, are never evicted."""
+    class ClosingConnection(MockConnection):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    @connection_cache(max_size=1)
+    def f(host, user, key_path):
+        """generic func to emulate _get_connection"""
+        return ClosingConnection(host, user, key_path)
+
+    with f.lease('a', 'me', 'key') as a:
+        b = f('b', 'me', 'key')
+        assert not a.closed
+        assert not b.closed
+        assert list(f.get_cache()) == ['a-me', 'b-me']
+
+        with f.lease('a', 'me', 'key') as again:
+            assert again is a
+
+    # once the lease is returned the cache shrinks back to its bound
+    c = f('c', 'me', 'key')
+    assert a.closed and b.closed
+    assert not c.closed
+    assert list(f.get_cache()) == ['c-me']
+
+
+def test_run_commands(monkeypatch):
+    """Test that a batch runs as one command and is split back into
+    per-command results."""
+    scripts = []
+
+    def mockreturn(host, script, *args):
+        scripts.append(script)
+        proc = subprocess.run(['sh', '-c', script], stdout=subprocess.PIPE)
+        return proc.returncode == 0, proc.stdout.decode()
+    monkeypatch.setattr(command, 'run_command', mockreturn)
+
+    results = command.run_commands('local', ['echo foo', 'printf bar', 'false', 'true'], noisy=False)
+    assert len(scripts) == 1
+    assert [r.output for r in results] == ['foo\n', 'bar', '', '']
+    assert [r.exit_code for r in results] == [0, 0, 1, 0]
+    assert [r.success for r in results] == [True, True, False, True]
+
+    results = command.run_commands('local', ['true', 'false', 'echo skipped'], noisy=False, stop_on_error=True)
+    assert [r.exit_code for r in results] == [0, 1, None]
+    assert not results[2].success
+
+
+def test_run_command_async(monkeypatch):
+    """Test that many remote commands can be awaited from one event loop."""
+    def mockreturn(host, command, *args):
+        time.sleep(0.1)
+        return True, host
+    monkeypatch.setattr(command, 'run_command', mockreturn)
+
+    async def run_all():
+        hosts = ['agent{}'.format(i) for i in range(20)]
+        return await asyncio.gather(*[command.run_command_async(h, 'true') for h in hosts])
+
+    start = time.time()
+    results = asyncio.get_event_loop().run_until_complete(run_all())
+    assert time.time() - start < 0.5
+    assert results[3] == (True, 'agent3')
+
+
+def test_prewarm_connections(monkeypatch):
+    """Test that connections are opened concurrently and failures reported."""
+    def mockreturn(host, username, key_path):
+        time.sleep(0.2)
+        if host == 'down':
+            return None
+        if host == 'bad':
+            raise ValueError('No valid key supplied')
+        return MockConnection(host, username, key_path)
+    cached = connection_cache(mockreturn, max_size=1)
+    monkeypatch.setattr(command, '_get_connection', cached)
+
+    start = time.time()
+    results = command.prewarm_connections(['master', 'agent', 'down', 'bad'])
+    assert time.time() - start < 0.4
+
+    # the cache is enlarged to keep every connection just opened
+    assert cached.settings()['max_size'] == 4
+    assert sorted(cached.get_cache()) == ['agent-None', 'master-None']
+    assert list(results) == ['master', 'agent', 'down', 'bad']
+    assert results['master'] >= 0.2
+    assert results['down'] is None
+    assert results['bad'] is None
+
+
+class MockSubcommandMain:
+
+    def __init__(self, command, args):
+        self.command = command
+        self.args = args
+
+    def run_and_capture(self):
+        if self.args == ['--bad']:
+            raise SystemExit('Usage: dcos {}'.format(self.command))
+        if self.args == ['--crash']:
+            return 1, 'Traceback: boom\n'
+        if self.args == ['--spin']:
+            # another thread printing while the command runs
+            spinner = threading.Thread(target=print, args=('spinning...',))
+            spinner.start()
+            spinner.join()
+        print(' '.join(self.args))
+        print('warning', file=sys.stderr)
+        return 3, None
+
+
+def test_run_dcos_command_in_process(monkeypatch, capsys):
+    import dcoscli.subcommand
+    monkeypatch.setattr(dcoscli.subcommand, 'SubcommandMain', MockSubcommandMain)
+
+    def fail(call):
+        raise AssertionError('unexpected subprocess {}'.format(call))
+    monkeypatch.setattr(command, '_run_dcos_subprocess', fail)
+
+    result = command.run_dcos_command("task ls 'my app'", print_output=False, in_process=True)
+    assert result == ('ls my app\n', 'warning\n', 3)
+
+    result = command.run_dcos_command('task --bad', print_output=False, in_process=True)
+    assert result == ('', 'Usage: dcos task\n', 1)
+
+    result = command.run_dcos_command('task --crash', print_output=False, in_process=True)
+    assert result == ('', 'Traceback: boom\n', 1)
+
+    capsys.readouterr()
+    result = command.run_dcos_command('task --spin', print_output=False, in_process=True)
+    assert result == ('--spin\n', 'warning\n', 3)
+    assert 'spinning...' in capsys.readouterr().out
+
+    # subcommands provided by packages still run the CLI
+    monkeypatch.setattr(command, '_run_dcos_subprocess', lambda call: ('', '', call))
+    stdout, stderr, call = command.run_dcos_command('kafka topic list', print_output=False, in_process=True)
+    assert call == ['dcos', 'kafka', 'topic', 'list']
+
+
+def test_run_dcos_commands(monkeypatch):
+    def mock_run_dcos_subprocess(call):
+        time.sleep(0.2)
+        if call[1] == 'bad':
+            return '', 'not found', 1
+        return ' '.join(call[1:]), '', 0
+    monkeypatch.setattr(command, '_run_dcos_subprocess', mock_run_dcos_subprocess)
+
+    start = time.time()
+    results = command.run_dcos_commands(['service', 'task ls', 'package list'], print_output=False)
+    assert time.time() - start < 0.5
+    assert [r.stdout for r in results] == ['service', 'task ls', 'package list']
+    assert all(r.success and r.duration >= 0.2 for r in results)
+
+    try:
+        command.run_dcos_commands(['service', 'bad'], raise_on_error=True, print_output=False)
+        assert False
+    except command.DCOSException as e:
+        assert '1 of 2 commands failed' in str(e)
+        assert 'dcos bad' in str(e)
+
+
+def test_run_command_cached(monkeypatch):
+    calls = []
+
+    def mock_run_command(host, cmd, *args):
+        calls.append((host, cmd))
+        return cmd != 'false', host
+
+    monkeypatch.setattr(command, 'run_command', mock_run_command)
+    command.invalidate_command_cache()
+
+    assert command.run_command_cached('agent1', 'uname -r', noisy=False) == (True, 'agent1')
+    assert command.run_command_cached('agent1', 'uname -r', noisy=False) == (True, 'agent1')
+    assert command.run_command_cached('agent1', 'uname -r', username='root', noisy=False) == (True, 'agent1')
+    assert len(calls) == 2
+
+    # failures are not cached and expired results are run again
+    assert command.run_command_cached('agent1', 'false', noisy=False) == (False, 'agent1')
+    assert command.run_command_cached('agent1', 'false', noisy=False) == (False, 'agent1')
+    assert command.run_command_cached('agent1', 'uname -r', noisy=False, ttl=0) == (True, 'agent1')
+    assert len(calls) == 5
+
+    # the default ttl is read when the command is run
+    ttl = command.COMMAND_CACHE_TTL
+    monkeypatch.setattr(command, 'COMMAND_CACHE_TTL', 0)
+    assert command.run_command_cached('agent1', 'uname -r', noisy=False) == (True, 'agent1')
+    assert len(calls) == 6
+    monkeypatch.setattr(command, 'COMMAND_CACHE_TTL', ttl)
+
+    results = command.run_command_on_hosts(['agent1', 'agent2'], 'uname -r', cache_ttl=60)
+    assert [r[1] for r in results.values()] == ['agent1', 'agent2']
+    assert calls[6:] == [('agent2', 'uname -r')]
+
+    command.invalidate_command_cache('agent1')
+    command.run_command_on_hosts(['agent1', 'agent2'], 'uname -r', cache_ttl=60)
+    assert calls[7:] == [('agent1', 'uname -r')]
+
+    command.invalidate_command_cache()
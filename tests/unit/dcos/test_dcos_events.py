@@ -0,0 +1,221 @@
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from shakedown.dcos import events, state
+from shakedown.dcos.service import get_service_task
+from shakedown.dcos.spinner import time_wait
+from shakedown.dcos.task import get_tasks
+
+
+def v1_task(task_id, name, task_state):
+    return {
+        'task_id': {'value': task_id},
+        'framework_id': {'value': 'marathon-id'},
+        'agent_id': {'value': 'agent-1'},
+        'name': name,
+        'state': task_state,
+        'resources': [
+            {'name': 'cpus', 'type': 'SCALAR', 'scalar': {'value': 0.5}},
+            {'name': 'ports', 'type': 'RANGES', 'ranges': {'range': [{'begin': 31000, 'end': 31001}]}},
+        ],
+        'statuses': [],
+    }
+
+
+SUBSCRIBED = {
+    'type': 'SUBSCRIBED',
+    'subscribed': {
+        'heartbeat_interval_seconds': 15,
+        'get_state': {
+            'get_frameworks': {'frameworks': [
+                {'framework_info': {'id': {'value': 'marathon-id'}, 'name': 'marathon', 'user': 'root'}, 'active': True},
+            ]},
+            'get_agents': {'agents': [
+                {'agent_info': {'id': {'value': 'agent-1'}, 'hostname': '10.0.0.1'}, 'active': True},
+            ]},
+            'get_tasks': {'tasks': [v1_task('sleep.1', 'sleep', 'TASK_RUNNING')]},
+        },
+    },
+}
+
+
+class OperatorAPIHandler(BaseHTTPRequestHandler):
+    """A stand-in for the master's operator API, which streams the events
+    put on the server's queue until it gets None."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):  # noqa: N802
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        assert body == {'type': 'SUBSCRIBE'}
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        while True:
+            event = self.server.events.get()
+            if event is None:
+                break
+            record = json.dumps(event).encode()
+            record = str(len(record)).encode() + b'\n' + record
+            # split records across chunks, as the stream may
+            for chunk in (record[:5], record[5:]):
+                self.wfile.write('{:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class OperatorAPIServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MarathonEventsHandler(BaseHTTPRequestHandler):
+    """ A stand-in for Marathon's `/v2/events`, which streams the
+    (event type, data) pairs put on the server's queue until it gets None."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # noqa: N802
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        while True:
+            event = self.server.events.get()
+            if event is None:
+                break
+            message = 'event: {}\ndata: {}\n\n'.format(*event).encode()
+            self.wfile.write('{:x}\r\n'.format(len(message)).encode() + message + b'\r\n')
+            self.wfile.flush()
+        self.wfile.write(b'0\r\n\r\n')
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+def test_recordio_records():
+    chunks = [b'7\n{"a":', b'1}10\n', b'{"b": [2]}']
+    assert list(events.recordio_records(chunks)) == [{'a': 1}, {'b': [2]}]
+
+
+def test_state_subscriber(monkeypatch):
+    server = OperatorAPIServer(('127.0.0.1', 0), OperatorAPIHandler)
+    server.events = queue.Queue()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    polled = []
+
+    def poll():
+        polled.append(True)
+        return {'frameworks': [], 'completed_frameworks': [], 'slaves': []}
+
+    monkeypatch.setattr(state, '_master_state', state.SnapshotCache(poll))
+    monkeypatch.setattr(events, 'SUBSCRIBE_RETRY_SECONDS', 60)
+
+    subscriber = events.start_state_subscriber('http://127.0.0.1:{}/api/v1'.format(server.server_port))
+    try:
+        server.events.put(SUBSCRIBED)
+        assert subscriber.wait_connected(5)
+
+        task = get_service_task('marathon', 'sleep')
+        assert task['id'] == 'sleep.1'
+        assert task['slave_id'] == 'agent-1'
+        assert task['resources'] == {'cpus': 0.5, 'ports': '[31000-31001]'}
+        assert state.get_master_state()['slaves'][0]['hostname'] == '10.0.0.1'
+
+        server.events.put({'type': 'TASK_ADDED', 'task_added': {'task': v1_task('sleep.2', 'sleep', 'TASK_STAGING')}})
+        server.events.put({'type': 'TASK_UPDATED', 'task_updated': {
+            'framework_id': {'value': 'marathon-id'},
+            'status': {'task_id': {'value': 'sleep.1'}, 'state': 'TASK_KILLED'},
+            'state': 'TASK_KILLED',
+        }})
+        server.events.put({'type': 'HEARTBEAT'})
+        deadline = time.time() + 5
+        while subscriber.events < 4 and time.time() < deadline:
+            threading.Event().wait(0.01)
+        assert subscriber.events == 4
+
+        assert [t['id'] for t in get_tasks('sleep', completed=False)] == ['sleep.2']
+        assert [t['id'] for t in get_tasks('sleep')] == ['sleep.1']
+        assert get_tasks('sleep')[0]['statuses'] == [{'state': 'TASK_KILLED'}]
+        assert not polled
+
+        # once the stream ends the helpers poll again
+        server.events.put(None)
+        deadline = time.time() + 5
+        while subscriber.connected and time.time() < deadline:
+            threading.Event().wait(0.01)
+        assert not subscriber.connected
+        assert get_tasks('sleep') == []
+        assert polled
+    finally:
+        events.stop_state_subscriber()
+        server.shutdown()
+        server.server_close()
+
+
+def test_sse_events():
+    lines = [b': comment', b'event: deployment_success', b'data: {"id": 1}', b'',
+             b'data: first', b'data: second', b'', b'']
+    assert list(events.sse_events(lines)) == [('deployment_success', '{"id": 1}'), ('message', 'first\nsecond')]
+
+
+def test_marathon_event_wakeup(monkeypatch):
+    server = OperatorAPIServer(('127.0.0.1', 0), MarathonEventsHandler)
+    server.events = queue.Queue()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    monkeypatch.setattr(events, 'SUBSCRIBE_RETRY_SECONDS', 60)
+    assert events.marathon_event_wakeup('deployment_success') is None
+
+    stream = events.start_marathon_events('http://127.0.0.1:{}/v2/events'.format(server.server_port))
+    try:
+        assert stream.wait_connected(5)
+
+        # the waiter wakes on the deployment event, not on its ten second fallback
+        deployed = []
+        threading.Timer(0.2, lambda: deployed.append(True) or server.events.put(('deployment_success', '{}'))).start()
+        server.events.put(('status_update_event', '{}'))
+        duration = time_wait(lambda: deployed, timeout_seconds=5, noisy=False,
+                             wakeup=events.marathon_event_wakeup('deployment_success'))
+        assert duration < 2
+
+        # while connected, a waiter still sleeps no longer than its interval
+        wakeup = events.marathon_event_wakeup('deployment_success')
+        start = time.time()
+        assert not wakeup.wait(0.1)
+        assert time.time() - start < 1
+
+        # being woken drops the shared state, so the next check sees the change
+        fetched = state.SnapshotCache(lambda: {'frameworks': []}, ttl=60)
+        monkeypatch.setattr(state, '_master_state', fetched)
+        state.get_master_state()
+        server.events.put(('deployment_success', '{}'))
+        assert wakeup.wait(5)
+        state.get_master_state()
+        assert fetched.fetches == 2
+
+        # once the stream drops, waiters are woken and go back to polling
+        wakeup = events.marathon_event_wakeup('deployment_success')
+        server.events.put(None)
+        assert wakeup.wait(5)
+        assert not stream.connected
+        start = time.time()
+        assert not wakeup.wait(0.1)
+        assert time.time() - start < 1
+    finally:
+        events.stop_marathon_events()
+        server.shutdown()
+        server.server_close()
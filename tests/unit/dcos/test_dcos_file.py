@@ -0,0 +1,201 @@
+import os
+import re
+import subprocess
+
+from shakedown.dcos import command, file
+from shakedown.dcos.command import connection_cache
+
+
+class MockSFTPFile:
+
+    def __init__(self, path, mode):
+        self.f = open(path, mode)
+        self.path = path
+        self.pipelined = False
+        self.prefetched = None
+
+    def set_pipelined(self, pipelined):
+        self.pipelined = pipelined
+
+    def prefetch(self, size):
+        self.prefetched = size
+
+    def stat(self):
+        return os.stat(self.path)
+
+    def read(self, size):
+        return self.f.read(size)
+
+    def write(self, data):
+        self.f.write(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.f.close()
+
+
+class MockSFTP:
+    """An SFTP client backed by the local filesystem."""
+
+    def __init__(self):
+        self.files = []
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def open(self, path, mode):
+        f = MockSFTPFile(path, mode)
+        self.files.append(f)
+        return f
+
+    def chmod(self, path, mode):
+        os.chmod(path, mode)
+
+
+def test_sftp_put_get(tmpdir):
+    data = os.urandom(100000)
+    local = tmpdir.join('artifact.bin')
+    local.write_binary(data)
+    os.chmod(str(local), 0o750)
+    remote = tmpdir.mkdir('remote')
+
+    sftp = MockSFTP()
+    assert file._sftp_put(sftp, str(local), str(remote)) == len(data)
+    assert sftp.files[0].pipelined
+    assert remote.join('artifact.bin').read_binary() == data
+    assert os.stat(str(remote.join('artifact.bin'))).st_mode & 0o777 == 0o750
+
+    download = tmpdir.mkdir('download')
+    assert file._sftp_get(sftp, str(remote.join('artifact.bin')), str(download)) == len(data)
+    assert sftp.files[1].prefetched == len(data)
+    assert download.join('artifact.bin').read_binary() == data
+
+
+def test_broadcast_file(monkeypatch, tmpdir):
+    """Test that the file is uploaded once and verified on every host."""
+    local = tmpdir.join('credentials.tar.gz')
+    local.write_binary(b'secret')
+    checksum = file._sha256(str(local))
+
+    commands = []
+    uploads = []
+
+    def mock_run_command(host, command, *args):
+        commands.append((host, command))
+        if 'detect_ip' in command:
+            return True, '10.0.0.1\n'
+        return True, '1234\n'
+
+    def mock_run_command_on_hosts(hosts, command, *args, **kwargs):
+        url = re.search(r'http://10\.0\.0\.1:7778/([0-9a-f]{32})/credentials\.tar\.gz', command)
+        assert url
+        urls.append(url.group(1))
+        return {
+            'good': (True, '{}  ./credentials.tar.gz\n'.format(checksum), 0.1),
+            'corrupt': (True, '{}  ./credentials.tar.gz\n'.format('0' * 64), 0.1),
+            'down': (False, '', 0.1),
+        }
+
+    urls = []
+    monkeypatch.setattr(file.shakedown, 'master_ip', lambda: 'master')
+    monkeypatch.setattr(file, 'run_command', mock_run_command)
+    monkeypatch.setattr(file, 'run_command_on_hosts', mock_run_command_on_hosts)
+    monkeypatch.setattr(file, 'copy_file', lambda *args: uploads.append(args) or True)
+
+    results = file.broadcast_file(str(local), ['good', 'corrupt', 'down'])
+    assert results == {'good': True, 'corrupt': False, 'down': False}
+    assert len(uploads) == 1
+    assert uploads[0][0] == 'master'
+    assert uploads[0][2].endswith('/' + urls[0])
+    assert all(host == 'master' for host, command in commands)
+    assert any('http.server --bind 10.0.0.1 7778' in command for host, command in commands)
+    assert commands[-1][1].startswith('kill 1234; rm -rf ')
+
+    # the staging directory is removed even if the upload fails
+    del commands[:]
+    monkeypatch.setattr(file, 'copy_file', lambda *args: False)
+    assert file.broadcast_file(str(local), ['good']) == {'good': False}
+    assert commands[-1][1].startswith('rm -rf shakedown-broadcast-')
+
+
+class LocalChannel:
+    """A channel which runs its command locally."""
+
+    def exec_command(self, command):
+        self.proc = subprocess.Popen(['sh', '-c', command], stdin=subprocess.PIPE)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def recv_exit_status(self):
+        return self.proc.wait()
+
+    def close(self):
+        pass
+
+
+class LocalTransport:
+
+    def open_session(self):
+        return LocalChannel()
+
+    def is_active(self):
+        return True
+
+    def is_authenticated(self):
+        return True
+
+
+def test_sync_tree(monkeypatch, tmpdir):
+    """Test that only changed files are sent."""
+    def mock_run_command(host, command, *args):
+        proc = subprocess.run(['sh', '-c', command], stdout=subprocess.PIPE)
+        return proc.returncode == 0, proc.stdout.decode()
+
+    monkeypatch.setattr(file, 'run_command', mock_run_command)
+    monkeypatch.setattr(file, '_get_connection', connection_cache(lambda *args: LocalTransport()))
+
+    local = tmpdir.mkdir('local')
+    local.join('a.txt').write('a')
+    local.mkdir('conf').join('b.txt').write('b')
+    remote = str(tmpdir.join('remote'))
+
+    assert sorted(file.sync_tree(str(local), 'agent', remote)) == ['a.txt', 'conf/b.txt']
+    assert tmpdir.join('remote', 'conf', 'b.txt').read() == 'b'
+
+    assert file.sync_tree(str(local), 'agent', remote) == []
+
+    local.join('conf', 'b.txt').write('changed')
+    results = file.sync_tree_to_hosts(str(local), ['agent'], remote)
+    assert results == {'agent': ['conf/b.txt']}
+    assert tmpdir.join('remote', 'conf', 'b.txt').read() == 'changed'
+
+
+def test_sync_tree_failures(monkeypatch, tmpdir, capsys):
+    """Test that an unreachable host or a failed checksum listing fails the sync."""
+    local = tmpdir.mkdir('local')
+    local.join('a.txt').write('a')
+    remote = str(tmpdir.join('remote'))
+
+    unreachable = connection_cache(lambda *args: None)
+    monkeypatch.setattr(command, '_get_connection', unreachable)
+    monkeypatch.setattr(file, '_get_connection', unreachable)
+    assert file.sync_tree(str(local), 'down', remote) is None
+    assert 'error: unable to sync {} to down:{}: unable to connect to down'.format(local, remote) \
+        in capsys.readouterr().out
+
+    def mock_run_command(host, command, *args):
+        return False, 'sha256sum: not found\n'
+
+    uploads = []
+    monkeypatch.setattr(file, 'run_command', mock_run_command)
+    monkeypatch.setattr(file, '_get_connection', connection_cache(lambda *args: uploads.append(args)))
+    assert file.sync_tree_to_hosts(str(local), ['agent'], remote) == {'agent': None}
+    assert 'error: unable to sync {} to agent:{}: sha256sum: not found'.format(local, remote) \
+        in capsys.readouterr().out
+    assert uploads == []
@@ -0,0 +1,216 @@
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+import shakedown
+from shakedown.dcos import command, helpers
+
+
+class MockChannel:
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.closed = False
+
+
+class MockTransport:
+
+    def __init__(self, host):
+        self.host = host
+        self.active = True
+        self.opened = []
+        self.keepalive = None
+        self.error = None
+
+    def is_active(self):
+        return self.active
+
+    def is_authenticated(self):
+        return self.active
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+    def open_channel(self, kind, dest, src, timeout=None):
+        assert timeout == helpers.MASTER_CHANNEL_TIMEOUT
+        if self.error:
+            raise self.error
+        channel = MockChannel(dest)
+        self.opened.append(channel)
+        return channel
+
+    def close(self):
+        self.active = False
+
+
+def mock_gateway(monkeypatch):
+    transports = []
+
+    def transport(host):
+        t = MockTransport(host)
+        transports.append(t)
+        return t
+
+    monkeypatch.setattr(shakedown, 'master_ip', lambda: 'master')
+    monkeypatch.setattr(helpers.paramiko, 'Transport', transport)
+    monkeypatch.setattr(helpers, 'start_transport', lambda t, u, k, h=None: t)
+    return helpers.MasterGateway(), transports
+
+
+def test_master_gateway_shares_transport(monkeypatch):
+    gateway, transports = mock_gateway(monkeypatch)
+
+    c1 = gateway.open_channel('agent1', 'core', None)
+    c2 = gateway.open_channel('agent2', 'core', None)
+
+    assert len(transports) == 1
+    assert c1.dest == ('agent1', 22)
+    assert c2.dest == ('agent2', 22)
+    assert gateway.channel_count() == 2
+
+    c1.closed = True
+    assert gateway.channel_count() == 1
+
+
+def test_master_gateway_reconnects(monkeypatch):
+    gateway, transports = mock_gateway(monkeypatch)
+
+    gateway.open_channel('agent1', 'core', None)
+    transports[0].active = False
+    gateway.open_channel('agent1', 'core', None)
+
+    assert len(transports) == 2
+    assert gateway.reconnects == 1
+    assert gateway.channel_count() == 1
+
+    gateway.close()
+    assert not transports[1].active
+    assert gateway.channel_count() == 0
+
+
+def test_master_gateway_channel_timeout(monkeypatch):
+    """Test that a master which stops opening channels is replaced, and that
+    one which can't reach the agent is kept."""
+    gateway, transports = mock_gateway(monkeypatch)
+
+    gateway.open_channel('agent1', 'core', None)
+    assert transports[0].keepalive == command._get_connection.settings()['keepalive']
+
+    transports[0].error = helpers.paramiko.SSHException('Timeout opening channel.')
+    gateway.open_channel('agent1', 'core', None)
+    assert len(transports) == 2
+    assert not transports[0].active
+    assert gateway.reconnects == 1
+
+    transports[1].error = helpers.paramiko.ChannelException(2, 'Connect failed')
+    with pytest.raises(helpers.paramiko.ChannelException):
+        gateway.open_channel('agent2', 'core', None)
+    assert len(transports) == 2
+    assert transports[1].active
+
+
+def test_master_gateway_closes_failed_transport(monkeypatch):
+    gateway, transports = mock_gateway(monkeypatch)
+
+    def start_transport(transport, username, key, host=None):
+        raise ValueError('No valid key supplied')
+
+    monkeypatch.setattr(helpers, 'start_transport', start_transport)
+    with pytest.raises(ValueError):
+        gateway.open_channel('agent1', 'core', None)
+    assert not transports[0].active
+
+
+class MockKey:
+
+    def __init__(self, name):
+        self.name = name
+
+    def get_fingerprint(self):
+        return self.name.encode()
+
+
+class MockAuthTransport:
+
+    def __init__(self, accepted):
+        self.accepted = accepted
+        self.attempts = []
+
+    def start_client(self):
+        pass
+
+    def auth_publickey(self, username, key):
+        self.attempts.append(key.name)
+        if key.name != self.accepted:
+            raise helpers.paramiko.AuthenticationException()
+
+
+def test_start_transport_remembers_key(monkeypatch):
+    helpers.clear_key_cache()
+    agent_keys = (MockKey('a'), MockKey('b'), MockKey('c'))
+    monkeypatch.setattr(helpers, '_agent_keys', lambda: agent_keys)
+
+    t = helpers.start_transport(MockAuthTransport('c'), 'core', MockKey('a'), 'agent1')
+    assert t.attempts == ['a', 'b', 'c']
+
+    # the working key is tried first, for the same host and for new hosts
+    t = helpers.start_transport(MockAuthTransport('c'), 'core', MockKey('a'), 'agent1')
+    assert t.attempts == ['c']
+    t = helpers.start_transport(MockAuthTransport('c'), 'core', MockKey('a'), 'agent2')
+    assert t.attempts == ['c']
+
+    helpers.clear_key_cache()
+
+
+def test_validate_key_cache(tmpdir):
+    path = str(tmpdir.join('id_rsa'))
+    helpers.paramiko.RSAKey.generate(1024).write_private_key_file(path)
+
+    key = helpers.validate_key(path)
+    assert helpers.validate_key(path) is key
+
+    helpers.paramiko.RSAKey.generate(1024).write_private_key_file(path)
+    os.utime(path, (0, 0))
+    assert helpers.validate_key(path) is not key
+    assert helpers.validate_key(str(tmpdir.join('missing'))) is False
+
+    helpers.clear_key_cache()
+
+
+class MockAgentSocket:
+    """An ssh-agent socket which fails if a request is sent before the reply
+    to the last one has been read."""
+
+    def __init__(self):
+        self.reply = b''
+        self.interleaved = False
+
+    def send(self, data):
+        if self.reply:
+            self.interleaved = True
+        time.sleep(0.001)
+        self.reply += struct.pack('>I', 1) + b'\x0e'
+
+    def recv(self, wanted):
+        time.sleep(0.001)
+        data, self.reply = self.reply[:wanted], self.reply[wanted:]
+        return data
+
+
+def test_ssh_agent_serializes_requests(monkeypatch):
+    monkeypatch.delenv('SSH_AUTH_SOCK', raising=False)
+    agent = helpers._SerialAgent()
+    agent._conn = MockAgentSocket()
+
+    replies = []
+    threads = [threading.Thread(target=lambda: replies.append(agent._send_message(b'sign')[0])) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert replies == [14] * 8
+    assert not agent._conn.interleaved
@@ -0,0 +1,45 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from dcos import http
+
+from shakedown.dcos import http_pool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):  # noqa: N802
+        body = b'{}'
+        self.send_response(200 if self.path == '/ok' else 500)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_http_pool_reuses_connections():
+    server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = '127.0.0.1:{}'.format(server.server_port)
+
+    try:
+        http_pool.configure_http_pool()
+        http_pool.reset_http_stats()
+
+        for _ in range(5):
+            assert http.get('http://{}/ok'.format(host)).status_code == 200
+        http.request('get', 'http://{}/fail'.format(host), is_success=lambda status: True)
+
+        stats = http_pool.http_stats()[host]
+        assert stats['requests'] == 6
+        assert stats['errors'] == 0
+        assert stats['connections'] == 1
+        assert stats['max_time'] <= stats['time']
+    finally:
+        # closes the kept-alive connection the server is waiting on
+        http_pool.configure_http_pool()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,24 @@
+from shakedown.dcos import command, master
+
+
+def test_restart_master_node(monkeypatch):
+    """Test that results cached under either master address are forgotten."""
+    commands = []
+
+    def mock_run_command(host, cmd, *args):
+        return True, cmd
+
+    monkeypatch.setattr(command, 'run_command', mock_run_command)
+    monkeypatch.setattr(master, 'run_command_on_master', lambda cmd: commands.append(cmd))
+    monkeypatch.setattr(master, 'master_ip', lambda: '52.0.0.1')
+    monkeypatch.setattr(master, 'master_leader_ip', lambda: '10.0.0.1')
+    command.invalidate_command_cache()
+
+    for host in ['52.0.0.1', '10.0.0.1', '10.0.0.2']:
+        command.run_command_cached(host, 'docker version', noisy=False)
+
+    master.restart_master_node()
+
+    assert commands == ['sudo /sbin/shutdown -r now']
+    assert [key[0] for key in command._command_cache] == ['10.0.0.2']
+    command.invalidate_command_cache()
@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import itertools
+import time
+import types
+
+import pytest
+
+from shakedown.dcos import spinner, state
+from shakedown.dcos.spinner import (async_time_wait, async_wait_for, ExponentialPoll, FastStartPoll, FixedPoll,
+                                    JitteredPoll, time_wait, TimeoutExpired, wait_for, wait_for_all, wait_for_any,
+                                    wait_while_exceptions)
+
+
+def first(poll, n):
+    return list(itertools.islice(poll.intervals(), n))
+
+
+def test_poll_strategies(monkeypatch):
+    assert first(FixedPoll(2), 3) == [2, 2, 2]
+    assert first(ExponentialPoll(0.5, 2, 3), 5) == [0.5, 1, 2, 3, 3]
+
+    for seconds in first(JitteredPoll(FixedPoll(1), 0.5), 100):
+        assert 0.5 <= seconds <= 1.5
+
+    now = [0]
+    monkeypatch.setattr(spinner, 'time_module', types.SimpleNamespace(time=lambda: now[0]))
+    intervals = FastStartPoll(0.1, 2, 1).intervals()
+    assert next(intervals) == 0.1
+    now[0] = 1.9
+    assert next(intervals) == 0.1
+    now[0] = 2
+    assert next(intervals) == 1
+
+
+def test_wait_for_poll(monkeypatch):
+    """Test that the strategy's sleeps are used, and clipped to the deadline."""
+    sleeps = []
+    now = [0]
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(spinner, 'time_module', types.SimpleNamespace(time=lambda: now[0], sleep=sleep))
+
+    calls = []
+    assert wait_for(lambda: calls.append(True) or len(calls) == 4, poll=ExponentialPoll(1, 2, 10)) is True
+    assert sleeps == [1, 2, 4]
+
+    del sleeps[:]
+    with pytest.raises(TimeoutExpired):
+        time_wait(lambda: False, timeout_seconds=10, noisy=False, poll=FixedPoll(4))
+    assert sleeps == [4, 4, 2]
+
+    del sleeps[:]
+    with pytest.raises(TimeoutExpired):
+        wait_while_exceptions(lambda: 1 / 0, timeout_seconds=1, sleep_seconds=5)
+    assert sleeps == [1]
+
+
+def test_wait_for_deadline():
+    start = time.time()
+    with pytest.raises(TimeoutExpired):
+        wait_for(lambda: False, timeout_seconds=0.2, sleep_seconds=10)
+    assert time.time() - start < 2
+
+
+def test_wait_for_all(monkeypatch):
+    """Test that each tick shares one state fetch between the pending predicates."""
+    ticks = [0]
+
+    def fetch():
+        ticks[0] += 1
+        return {'tick': ticks[0]}
+
+    monkeypatch.setattr(state, '_master_state', state.SnapshotCache(fetch, ttl=0))
+
+    def passes_at(tick):
+        return lambda: state.get_master_state()['tick'] >= tick
+
+    times = wait_for_all({'a': passes_at(1), 'b': passes_at(3), 'c': passes_at(2)}, timeout_seconds=5, poll=FixedPoll(0.01))
+    assert sorted(times, key=times.get) == ['a', 'c', 'b']
+    assert ticks[0] == 3
+
+    ticks[0] = 0
+    assert list(wait_for_any([passes_at(2), passes_at(4)], poll=FixedPoll(0.01))) == [0]
+    assert ticks[0] == 2
+
+    with pytest.raises(TimeoutExpired) as e:
+        wait_for_all({'a': passes_at(0), 'never': lambda: False}, timeout_seconds=0.05, poll=FixedPoll(0.01))
+    assert 'never' in str(e.value)
+
+
+def test_async_wait_for():
+    """Test that many waits, sync and async, run concurrently on one loop."""
+    calls = []
+
+    def sync_predicate():
+        calls.append('sync')
+        return calls.count('sync') >= 3
+
+    async def async_predicate():
+        calls.append('async')
+        return calls.count('async') >= 2
+
+    async def running():
+        calls.append('running')
+        return True
+
+    async def main():
+        return await asyncio.gather(
+            async_wait_for(sync_predicate, poll=FixedPoll(0.05)),
+            async_time_wait(async_predicate, noisy=False, poll=FixedPoll(0.05)),
+            async_wait_for(lambda: async_predicate(), poll=FixedPoll(0.05)),
+            async_wait_for(running, required_consecutive_success_count=3, poll=FixedPoll(0.05)),
+            async_wait_for(running, inverse_predicate=True, timeout_seconds=0.3, poll=FixedPoll(0.05)),
+            return_exceptions=True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.time()
+        sync_result, duration, async_result, steady, timed_out = loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+    assert sync_result is True
+    assert 0 < duration < 1
+    assert async_result is True
+    assert steady is True
+    assert isinstance(timed_out, TimeoutExpired)
+    assert time.time() - start < 1
+
+
+def test_timeout_record():
+    def service_ready(service_name, count):
+        raise ValueError('not yet')
+
+    service_name = 'kafka'
+    with pytest.raises(TimeoutExpired) as e:
+        wait_for(lambda: service_ready(service_name, 3), timeout_seconds=0.1, sleep_seconds=0.02)
+
+    record = e.value.record
+    assert record.name == 'test_timeout_record.<locals>.<lambda>'
+    assert record.arguments == {'service_name': 'kafka', 'service_ready': service_ready}
+    assert record.polls > 1
+    assert isinstance(record.last_exception, ValueError)
+    assert record.elapsed >= 0.1
+    assert "service_name='kafka'" in str(e.value)
+    assert "last exception: ValueError('not yet'" in str(e.value)
+
+    with pytest.raises(TimeoutExpired) as e:
+        wait_for(functools.partial(max, 0, 0), timeout_seconds=0)
+    assert e.value.record.name == 'max'
+    assert e.value.record.arguments == {0: 0, 1: 0}
+    assert e.value.record.polls == 1
+    assert 'after 1 call in' in str(e.value)
+    assert str(e.value).endswith('last result: 0')
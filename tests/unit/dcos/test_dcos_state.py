@@ -0,0 +1,160 @@
+import threading
+import time
+
+from dcos import mesos
+
+from shakedown.dcos import service, state
+from shakedown.dcos.service import get_service
+from shakedown.dcos.task import get_task, get_tasks, task_completed
+
+
+def test_snapshot_cache():
+    values = iter(range(100))
+    cache = state.SnapshotCache(lambda: next(values), ttl=0.2)
+
+    assert cache.get() == 0
+    assert cache.get() == 0
+    assert cache.get(fresh=True) == 1
+    cache.invalidate()
+    assert cache.get() == 2
+    time.sleep(0.2)
+    assert cache.get() == 3
+    assert cache.fetches == 4
+
+
+def test_snapshot_cache_shares_concurrent_fetch():
+    def fetch():
+        time.sleep(0.1)
+        return {}
+
+    cache = state.SnapshotCache(fetch)
+    threads = [threading.Thread(target=cache.get) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert cache.fetches == 1
+
+
+class MockDCOSClient:
+    fetches = 0
+
+    def get_master_state(self):
+        MockDCOSClient.fetches += 1
+        task = {'id': 'sleep.1', 'name': 'sleep', 'state': 'TASK_RUNNING', 'framework_id': 'f1', 'slave_id': 's1'}
+        return {
+            'frameworks': [{'id': 'f1', 'name': 'marathon', 'active': True, 'tasks': [task], 'completed_tasks': []}],
+            'completed_frameworks': [],
+            'slaves': [{'id': 's1'}],
+        }
+
+
+def test_helpers_share_master_state(monkeypatch):
+    monkeypatch.setattr(state.mesos, 'DCOSClient', MockDCOSClient)
+    state.invalidate_state_cache()
+
+    assert get_service('marathon')['id'] == 'f1'
+    assert [t['id'] for t in get_tasks('sleep', completed=False)] == ['sleep.1']
+    assert MockDCOSClient.fetches == 1
+
+    state.get_master_state(fresh=True)
+    assert MockDCOSClient.fetches == 2
+
+    state.invalidate_state_cache()
+
+
+def mock_state():
+    def task(i, framework_id, state):
+        return {'id': 'app{}.{}'.format(i % 3, i), 'name': 'app{}'.format(i % 3), 'state': state,
+                'framework_id': framework_id, 'slave_id': 's{}'.format(i % 2)}
+
+    return {
+        'frameworks': [
+            {'id': 'f1', 'name': 'marathon', 'active': True,
+             'tasks': [task(i, 'f1', 'TASK_RUNNING') for i in range(10)],
+             'completed_tasks': [task(i, 'f1', 'TASK_KILLED') for i in range(10, 20)]},
+            {'id': 'f2', 'name': 'kafka', 'active': False,
+             'tasks': [task(i, 'f2', 'TASK_FAILED') for i in range(20, 25)],
+             'completed_tasks': []},
+        ],
+        'completed_frameworks': [
+            {'id': 'f0', 'name': 'marathon', 'active': False, 'tasks': [],
+             'completed_tasks': [task(i, 'f0', 'TASK_FINISHED') for i in range(25, 30)]},
+        ],
+    }
+
+
+def test_task_index_matches_master():
+    index = state.TaskIndex(mock_state())
+    master = mesos.Master(index.state)
+
+    for fltr in ['', 'app1', 'app1.1', '*.2?', 'missing']:
+        for completed in [False, True]:
+            expected = [t.dict() for t in master.tasks(fltr=fltr, completed=completed)]
+            assert index.matching(fltr, completed) == expected
+
+    assert [t['id'] for t in index.by_prefix('app1.1')] == ['app1.1']
+    assert [t['id'] for t in index.by_prefix('app1.1', completed=True)] == ['app1.10', 'app1.13', 'app1.16', 'app1.19']
+    assert [t['id'] for t in index.lookup('app1.1')] == ['app1.1']
+    assert len(index.by_agent('s0')) == 8
+    assert len(index.by_framework('f2')) == 5
+    assert len(index.by_state('TASK_FAILED')) == 5
+    assert index.framework('marathon')['id'] == 'f1'
+    assert index.framework('marathon', completed=True)['id'] == 'f0'
+    assert index.framework('kafka') is None
+
+
+def test_task_helpers(monkeypatch):
+    master_state = mock_state()
+    monkeypatch.setattr(state, 'get_master_state', lambda fresh=False: master_state)
+
+    assert state.get_task_index() is state.get_task_index()
+    assert service.get_service_task('marathon', 'app2')['id'] == 'app2.2'
+    assert service.get_service_task('kafka', 'app2') is None
+    assert service.get_service_task('kafka', 'app2', inactive=True)['id'] == 'app2.20'
+    assert service.get_mesos_task('app0')['id'] == 'app0.0'
+    assert get_task('app1.1', completed=False)['id'] == 'app1.1'
+    assert task_completed('app1.10')
+    assert not task_completed('app1.1')
+
+
+def test_snapshot_cache_pin():
+    values = iter(range(100))
+    cache = state.SnapshotCache(lambda: next(values), ttl=60)
+
+    assert cache.get() == 0
+    with cache.pin():
+        # a pin fetches once, then shares that snapshot
+        assert cache.get() == 1
+        with cache.pin():
+            assert cache.get() == 1
+        assert cache.get() == 1
+        assert cache.get(fresh=True) == 2
+        assert cache.get() == 2
+    assert cache.get(fresh=True) == 3
+
+
+def test_snapshot_cache_overlapping_pins():
+    """Test that pins in one thread don't leak into another's."""
+    values = iter(range(100))
+    cache = state.SnapshotCache(lambda: next(values), ttl=0)
+    entered = threading.Event()
+    release = threading.Event()
+
+    def pinned():
+        with cache.pin():
+            cache.get()
+            entered.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=pinned)
+    thread.start()
+    assert entered.wait(5)
+    with cache.pin():
+        first = cache.get()
+        release.set()
+        thread.join()
+    assert cache.get() > first
+    assert cache.get() != cache.get()
+    assert cache.get(fresh=True) != first